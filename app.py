@@ -1,13 +1,34 @@
+import atexit
+import bisect
 import csv
+import hashlib
+import heapq
 import io
 import json
+import math
+import os
+import random
+import re
+import socket
+import sqlite3
+import sys
 import time
-from dataclasses import dataclass
-from datetime import datetime
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, is_dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal, DecimalException
 from functools import wraps
 from typing import Dict, Optional, List, Tuple
 
-from sqlalchemy import func
+import click
+from eventlet import tpool
+from eventlet.semaphore import Semaphore
+from sqlalchemy import create_engine, event, func, insert, update
+from sqlalchemy.orm import scoped_session, sessionmaker
 from flask import (
     Flask,
     render_template,
@@ -17,12 +38,14 @@ from flask import (
     abort,
     session,
     Response,
+    stream_with_context,
 )
+from flask.globals import app_ctx
 from flask_socketio import SocketIO, join_room, emit
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from config import Config
-from models import db, AuthUser, Match, Task
+from models import db, AuthUser, Match, Task, UserStats
 
 
 # ----------------------------
@@ -32,7 +55,240 @@ app = Flask(__name__)
 app.config.from_object(Config)
 
 db.init_app(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="eventlet")
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    async_mode="eventlet",
+    # emit(..., to=room) дойдёт до игроков, подключённых к другим воркерам
+    message_queue=Config.SOCKETIO_MESSAGE_QUEUE or None,
+)
+
+
+# ----------------------------
+# DB engine profile
+# ----------------------------
+def sqlite_pragmas(readonly: bool = False):
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        if readonly:
+            cur.execute("PRAGMA query_only=ON")
+        else:
+            # WAL: читатели не блокируют писателя, коммит — без полного fsync
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cur.execute(f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}")
+        cur.execute(f"PRAGMA cache_size=-{int(app.config['SQLITE_CACHE_SIZE_KB'])}")
+        cur.close()
+
+    return on_connect
+
+
+# сессия на read-only движке (None — читаем через db.session)
+READ_SESSION: Optional[scoped_session] = None
+
+
+def setup_engines():
+    global READ_SESSION
+    with app.app_context():
+        engine = db.engine
+        is_sqlite = engine.url.get_backend_name() == "sqlite"
+        if is_sqlite and app.config.get("DB_PROFILE") == "sqlite-wal":
+            event.listen(engine, "connect", sqlite_pragmas())
+
+        ro_url = app.config.get("DATABASE_READONLY_URL") or ""
+        if ro_url == "auto":
+            if not is_sqlite or not engine.url.database or engine.url.database == ":memory:":
+                return
+            ro_url = f"sqlite:///file:{engine.url.database}?mode=ro&uri=true"
+        if not ro_url:
+            return
+
+        ro_engine = create_engine(ro_url, **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        if ro_engine.url.get_backend_name() == "sqlite":
+            event.listen(ro_engine, "connect", sqlite_pragmas(readonly=True))
+        # сессия на app context — так же, как у db.session
+        READ_SESSION = scoped_session(
+            sessionmaker(bind=ro_engine), scopefunc=lambda: id(app_ctx._get_current_object())
+        )
+
+
+setup_engines()
+
+
+@app.teardown_appcontext
+def remove_read_session(_exc=None):
+    if READ_SESSION is not None:
+        READ_SESSION.remove()
+
+
+def read_db():
+    """
+    Сессия для тяжёлых чтений (статистика, админка): read-only движок, если настроен.
+    """
+    return READ_SESSION if READ_SESSION is not None else db.session
+
+
+# ----------------------------
+# DB executor (блокирующий I/O — в пул нативных потоков)
+# ----------------------------
+class DbExecutor:
+    """
+    sqlite3 — блокирующие C-вызовы: пока они идут в гринлете, хаб eventlet стоит.
+    Поэтому запросы из сокет-обработчиков уходят в eventlet.tpool, не больше
+    DB_THREADS одновременно; остальные ждут на семафоре (очередь).
+    Функция выполняется в своём app context со своей db.session и должна
+    возвращать простые данные, а не ORM-объекты.
+    """
+
+    def __init__(self, size: int, mode: str):
+        self.mode = mode
+        self.sem = Semaphore(size)
+        self.size = size
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+
+    @staticmethod
+    def _call(fn, args, kwargs):
+        with app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                db.session.remove()
+
+    def run(self, fn, *args, **kwargs):
+        if self.mode != "tpool":
+            return self._call(fn, args, kwargs)
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        with self.sem:
+            self.waiting -= 1
+            started = time.perf_counter()
+            self.in_flight += 1
+            try:
+                return tpool.execute(self._call, fn, args, kwargs)
+            finally:
+                done = time.perf_counter()
+                self.in_flight -= 1
+                self.calls += 1
+                wait, spent = started - queued, done - started
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                self.exec_total += spent
+                self.exec_max = max(self.exec_max, spent)
+
+    def stats(self) -> Dict:
+        calls = self.calls or 1
+        return {
+            "mode": self.mode,
+            "threads": self.size,
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "wait_avg_ms": round(self.wait_total / calls * 1000, 2),
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+            "exec_avg_ms": round(self.exec_total / calls * 1000, 2),
+            "exec_max_ms": round(self.exec_max * 1000, 2),
+        }
+
+
+DB_EXECUTOR = DbExecutor(Config.DB_THREADS, Config.DB_EXECUTOR)
+
+
+def run_db(fn, *args, **kwargs):
+    return DB_EXECUTOR.run(fn, *args, **kwargs)
+
+
+def db_load_user(user_id: int) -> Optional[Dict]:
+    u = db.session.get(AuthUser, user_id)
+    if not u:
+        return None
+    return {"id": u.id, "username": u.username, "rating": int(u.rating)}
+
+
+class UserCache:
+    """
+    Read-through кэш профиля игрока (username, rating) для сокет-обработчиков.
+    Сбрасывается, когда меняется рейтинг (после коммита итогов матчей в БД)
+    и при удалении пользователя; TTL — страховка для кэшей других воркеров.
+    """
+
+    def __init__(self, ttl: float, size: int):
+        self.ttl = ttl
+        self.size = size
+        self.entries: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        hit = self.entries.get(user_id)
+        if hit is not None and hit[0] > time.time():
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return hit[1]
+
+        self.misses += 1
+        generation = self.generation
+        user = run_db(db_load_user, user_id)
+        # пока ждали БД, кэш сбросили — прочитанное могло уже устареть
+        if user is not None and generation == self.generation:
+            self.entries[user_id] = (time.time() + self.ttl, user)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, *user_ids: int):
+        self.generation += 1
+        for user_id in user_ids:
+            self.entries.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+USER_CACHE = UserCache(Config.USER_CACHE_TTL, Config.USER_CACHE_SIZE)
+
+
+def db_load_match(match_id: int) -> Optional[Dict]:
+    m = db.session.get(Match, match_id)
+    if not m:
+        return None
+    return {
+        "id": m.id,
+        "player1_id": m.player1_id,
+        "player2_id": m.player2_id,
+        "player1_name": m.player1_name,
+        "player2_name": m.player2_name,
+        "duration_sec": m.duration_sec,
+        "status": m.status,
+    }
+
+
+def db_mark_match_started(match_id: int):
+    m = db.session.get(Match, match_id)
+    if not m:
+        return
+    m.status = "started"
+    m.started_at = datetime.utcnow()
+    db.session.commit()
+
+
+def db_create_matches(rows: List[Dict]) -> List[int]:
+    """
+    Создаёт матчи одной транзакцией, возвращает их id в том же порядке.
+    """
+    matches = [Match(**r) for r in rows]
+    db.session.add_all(matches)
+    db.session.commit()
+    return [m.id for m in matches]
 
 
 # ----------------------------
@@ -60,6 +316,107 @@ def normalize_topic(val: str) -> str:
     return v if v else DEFAULT_TOPIC
 
 
+# ----------------------------
+# Password hashing (пул процессов)
+# ----------------------------
+def _hash_job(password: str, method: str):
+    started = time.time()
+    return generate_password_hash(password, method=method), started, time.time()
+
+
+def _verify_job(pwhash: str, password: str):
+    started = time.time()
+    return check_password_hash(pwhash, password), started, time.time()
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """
+    scrypt/pbkdf2 специально тяжёлые: на хабе eventlet они замораживают все таймеры.
+    Считаем их в пуле процессов; одновременно в работе/очереди не больше max_pending,
+    лишние запросы сразу получают HasherBusy (лучше быстрый отказ, чем зависший вход).
+    """
+
+    def __init__(self, workers: int, max_pending: int, mode: str, method: str):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.mode = mode
+        self.method = method
+        # префикс хэша с развёрнутыми параметрами ("scrypt" -> "scrypt:32768:8:1")
+        self.method_prefix: Optional[str] = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.rejected = 0
+        self.calls = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+
+    def _run(self, job, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy()
+
+        self.pending += 1
+        submitted = time.time()
+        try:
+            if self.mode == "process":
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                future = self.pool.submit(job, *args)
+                # ждём в нативном потоке, хаб продолжает работать
+                result, started, finished = tpool.execute(future.result)
+            else:
+                result, started, finished = job(*args)
+        finally:
+            self.pending -= 1
+
+        self.calls += 1
+        wait, spent = max(0.0, started - submitted), finished - started
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.exec_total += spent
+        self.exec_max = max(self.exec_max, spent)
+        return result
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash_job, password, self.method)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self._run(_verify_job, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        # короткие формы ("scrypt", "pbkdf2:sha256") werkzeug дополняет параметрами
+        # по умолчанию — сравниваем с префиксом настоящего хэша, посчитанного один раз
+        if self.method_prefix is None:
+            self.method_prefix = self.hash("method-probe").split("$", 1)[0]
+        return pwhash.split("$", 1)[0] != self.method_prefix
+
+    def stats(self) -> Dict:
+        calls = self.calls or 1
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "calls": self.calls,
+            "wait_avg_ms": round(self.wait_total / calls * 1000, 2),
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+            "hash_avg_ms": round(self.exec_total / calls * 1000, 2),
+            "hash_max_ms": round(self.exec_max * 1000, 2),
+        }
+
+
+PASSWORDS = PasswordHasher(
+    Config.HASH_WORKERS, Config.HASH_MAX_PENDING, Config.HASH_EXECUTOR, Config.PASSWORD_HASH_METHOD
+)
+HASHER_BUSY_TEXT = "Сервер занят, попробуйте ещё раз через пару секунд."
+
+
 # ----------------------------
 # Auth helpers
 # ----------------------------
@@ -106,6 +463,413 @@ def elo_apply(r_a: int, r_b: int, score_a: float, k: int) -> int:
     return int(round(r_a + k * (score_a - exp_a)))
 
 
+# ----------------------------
+# User stats (денормализованные счётчики)
+# ----------------------------
+def user_stats_row(user_id: int, rating: int) -> UserStats:
+    st = db.session.get(UserStats, user_id)
+    if not st:
+        st = UserStats(user_id=user_id, ended=0, wins=0, losses=0, draws=0, peak_rating=rating)
+        db.session.add(st)
+    return st
+
+
+def record_match_stats(m: Match, ratings: Dict[int, int]):
+    """
+    Учитываем завершённый матч в user_stats. ratings — рейтинги после Elo.
+    Коммит — на вызывающем (в одной транзакции с самим матчем).
+    """
+    for uid in (m.player1_id, m.player2_id):
+        if uid not in ratings:
+            continue
+        st = user_stats_row(uid, ratings[uid])
+        st.ended += 1
+        if m.winner_user_id is None:
+            st.draws += 1
+        elif m.winner_user_id == uid:
+            st.wins += 1
+        else:
+            st.losses += 1
+        st.last_match_at = m.ended_at
+        st.peak_rating = max(st.peak_rating or 0, ratings[uid])
+
+
+def forget_user_matches(user_id: int):
+    """
+    Перед удалением пользователя вычитаем его матчи из счётчиков соперников.
+    """
+    rows = (
+        db.session.query(Match.player1_id, Match.player2_id, Match.winner_user_id)
+        .filter(Match.status == "ended")
+        .filter((Match.player1_id == user_id) | (Match.player2_id == user_id))
+        .all()
+    )
+    for p1_id, p2_id, winner_id in rows:
+        opp_id = p2_id if p1_id == user_id else p1_id
+        st = db.session.get(UserStats, opp_id)
+        if not st:
+            continue
+        st.ended = max(0, st.ended - 1)
+        if winner_id is None:
+            st.draws = max(0, st.draws - 1)
+        elif winner_id == opp_id:
+            st.wins = max(0, st.wins - 1)
+        else:
+            st.losses = max(0, st.losses - 1)
+
+    st = db.session.get(UserStats, user_id)
+    if st:
+        db.session.delete(st)
+
+
+def rebuild_user_stats() -> int:
+    """
+    Пересобирает user_stats целиком по таблице matches. Возвращает число строк.
+    """
+    ratings = dict(db.session.query(AuthUser.id, AuthUser.rating).all())
+    acc: Dict[int, Dict] = {}
+
+    q = (
+        db.session.query(
+            Match.player1_id,
+            Match.player2_id,
+            Match.player1_rating,
+            Match.player2_rating,
+            Match.winner_user_id,
+            Match.ended_at,
+        )
+        .filter(Match.status == "ended")
+        .order_by(Match.id)
+        .yield_per(10000)
+    )
+    for p1_id, p2_id, p1_rating, p2_rating, winner_id, ended_at in q:
+        for uid, pre_rating in ((p1_id, p1_rating), (p2_id, p2_rating)):
+            if uid not in ratings:
+                continue
+            st = acc.get(uid)
+            if st is None:
+                st = acc[uid] = {
+                    "user_id": uid,
+                    "ended": 0,
+                    "wins": 0,
+                    "losses": 0,
+                    "draws": 0,
+                    "last_match_at": None,
+                    "peak_rating": ratings[uid],
+                }
+            st["ended"] += 1
+            if winner_id is None:
+                st["draws"] += 1
+            elif winner_id == uid:
+                st["wins"] += 1
+            else:
+                st["losses"] += 1
+            if ended_at and (st["last_match_at"] is None or ended_at > st["last_match_at"]):
+                st["last_match_at"] = ended_at
+            st["peak_rating"] = max(st["peak_rating"], pre_rating or 0)
+
+    UserStats.query.delete(synchronize_session=False)
+    if acc:
+        db.session.execute(insert(UserStats), list(acc.values()))
+    db.session.commit()
+    return len(acc)
+
+
+@app.cli.command("backfill-stats")
+def backfill_stats_command():
+    """Пересобрать user_stats по истории матчей."""
+    db.create_all()
+    n = rebuild_user_stats()
+    click.echo(f"user_stats: {n} rows")
+
+
+# ----------------------------
+# Leaderboard (индекс мест по рейтингу)
+# ----------------------------
+class RatingIndex:
+    """
+    Места игроков по рейтингу в памяти процесса: дерево Фенвика по корзинам
+    рейтинга (корзина = одно значение рейтинга, выше — раньше) и в каждой
+    корзине отсортированный список игроков. Место игрока, игрок на месте k
+    и окно вокруг места — за O(log R), без COUNT(*) по таблице.
+    Порядок — как в админке: рейтинг по убыванию, при равенстве — по id.
+    """
+
+    RATING_MIN = 0
+    RATING_MAX = 5000  # рейтинги вне диапазона попадают в крайние корзины
+
+    def __init__(self, refresh: float = 0.0):
+        self.size = self.RATING_MAX - self.RATING_MIN + 1
+        self.refresh = refresh
+        self.loaded_at = 0.0
+        self.loaded = False
+        self._clear()
+
+    def _clear(self):
+        self.tree = [0] * (self.size + 1)
+        self.buckets: Dict[int, List[Tuple[int, int]]] = {}  # slot -> [(-rating, user_id)]
+        self.users: Dict[int, Tuple[int, str]] = {}  # user_id -> (rating, username)
+
+    def _slot(self, rating: int) -> int:
+        return self.RATING_MAX - min(self.RATING_MAX, max(self.RATING_MIN, rating))
+
+    def _add(self, slot: int, delta: int):
+        i = slot + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def _before(self, slot: int) -> int:
+        """
+        Сколько игроков в корзинах [0, slot) — то есть с рейтингом выше.
+        """
+        total = 0
+        i = slot
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, pos: int) -> int:
+        """
+        Корзина, в которой лежит игрок на позиции pos (с нуля).
+        """
+        slot = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = slot + step
+            if nxt <= self.size and self.tree[nxt] <= pos:
+                slot = nxt
+                pos -= self.tree[nxt]
+            step >>= 1
+        return slot
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def set(self, user_id: int, username: str, rating: int):
+        self.remove(user_id)
+        slot = self._slot(rating)
+        bisect.insort(self.buckets.setdefault(slot, []), (-rating, user_id))
+        self._add(slot, 1)
+        self.users[user_id] = (rating, username)
+
+    def remove(self, user_id: int):
+        cur = self.users.pop(user_id, None)
+        if cur is None:
+            return
+        slot = self._slot(cur[0])
+        bucket = self.buckets[slot]
+        del bucket[bisect.bisect_left(bucket, (-cur[0], user_id))]
+        if not bucket:
+            del self.buckets[slot]
+        self._add(slot, -1)
+
+    def update_ratings(self, ratings: Dict[int, int]):
+        for user_id, rating in ratings.items():
+            cur = self.users.get(user_id)
+            if cur is not None and cur[0] != rating:
+                self.set(user_id, cur[1], rating)
+
+    def load(self):
+        self._clear()
+        rows = db.session.query(AuthUser.id, AuthUser.username, AuthUser.rating).all()
+        for user_id, username, rating in rows:
+            slot = self._slot(rating)
+            self.buckets.setdefault(slot, []).append((-rating, user_id))
+            self.users[user_id] = (rating, username)
+        for slot, bucket in self.buckets.items():
+            bucket.sort()
+            # дерево строим за O(R): сначала счётчики, потом проталкиваем вверх
+            self.tree[slot + 1] = len(bucket)
+        for i in range(1, self.size + 1):
+            j = i + (i & -i)
+            if j <= self.size:
+                self.tree[j] += self.tree[i]
+        self.loaded = True
+        self.loaded_at = time.time()
+
+    def ensure_loaded(self):
+        # при нескольких воркерах рейтинги меняют и соседи — перечитываем раз в refresh сек
+        stale = self.refresh > 0 and time.time() - self.loaded_at > self.refresh
+        if not self.loaded or stale:
+            self.load()
+
+    def position(self, user_id: int) -> Optional[int]:
+        self.ensure_loaded()
+        cur = self.users.get(user_id)
+        if cur is None:
+            return None
+        slot = self._slot(cur[0])
+        return self._before(slot) + bisect.bisect_left(self.buckets[slot], (-cur[0], user_id))
+
+    def rank(self, user_id: int) -> Optional[int]:
+        pos = self.position(user_id)
+        return pos + 1 if pos is not None else None
+
+    def window(self, start: int, count: int) -> List[Dict]:
+        """
+        Игроки на позициях [start, start + count): место, id, логин, рейтинг.
+        """
+        self.ensure_loaded()
+        out = []
+        pos = max(0, start)
+        end = min(len(self.users), pos + count)
+        while pos < end:
+            slot = self._find(pos)
+            bucket = self.buckets[slot]
+            i = pos - self._before(slot)
+            while i < len(bucket) and pos < end:
+                _neg, user_id = bucket[i]
+                rating, username = self.users[user_id]
+                out.append({"rank": pos + 1, "user_id": user_id, "username": username, "rating": rating})
+                i += 1
+                pos += 1
+        return out
+
+    def top(self, n: int) -> List[Dict]:
+        return self.window(0, n)
+
+    def around(self, user_id: int, radius: int) -> List[Dict]:
+        pos = self.position(user_id)
+        if pos is None:
+            return []
+        return self.window(pos - radius, 2 * radius + 1)
+
+
+RATINGS = RatingIndex(refresh=Config.RATING_INDEX_REFRESH)
+
+LEADERBOARD_TOP = 50
+LEADERBOARD_AROUND = 5
+
+
+# ----------------------------
+# Elo replay (пересчёт рейтингов по истории)
+# ----------------------------
+ELO_START = 1000
+# ожидаемый счёт зависит только от разницы рейтингов — считаем таблицу один раз
+ELO_DIFF_MAX = 4000
+
+
+def elo_expected_table() -> List[float]:
+    return [elo_expected(0, d) for d in range(-ELO_DIFF_MAX, ELO_DIFF_MAX + 1)]
+
+
+def replay_elo(k: int, start: int = ELO_START) -> Dict:
+    """
+    Проигрывает Elo по всем завершённым матчам в порядке ended_at.
+    Рейтинги — в array по плотному индексу пользователя, матчи читаются потоком
+    (только id игроков и победителя). Результат — по тем же правилам, что и в
+    MatchResultWriter (целые рейтинги, округление после каждого матча).
+    """
+    users = db.session.query(AuthUser.id, AuthUser.rating).order_by(AuthUser.id).all()
+    pos = {uid: i for i, (uid, _r) in enumerate(users)}
+    ratings = array("l", [start]) * len(users)
+    peaks = array("l", [start]) * len(users)
+    table = elo_expected_table()
+    offset = ELO_DIFF_MAX
+
+    started = time.perf_counter()
+    n = 0
+    # на миллионах строк ORM-обёртки строк дороже самого пересчёта — читаем курсором драйвера
+    rows = db.session.connection().exec_driver_sql(
+        f"SELECT player1_id, player2_id, winner_user_id FROM {Match.__tablename__} "
+        "WHERE status = 'ended' ORDER BY ended_at, id"
+    )
+    for p1_id, p2_id, winner_id in rows:
+        i = pos.get(p1_id)
+        j = pos.get(p2_id)
+        if i is None or j is None:
+            continue
+        r1 = ratings[i]
+        r2 = ratings[j]
+        d = r2 - r1
+        if -offset <= d <= offset:
+            e1 = table[offset + d]
+            e2 = table[offset - d]
+        else:
+            e1 = elo_expected(r1, r2)
+            e2 = elo_expected(r2, r1)
+        if winner_id == p1_id:
+            s1 = 1.0
+        elif winner_id == p2_id:
+            s1 = 0.0
+        else:
+            s1 = 0.5
+        r1 = int(round(r1 + k * (s1 - e1)))
+        r2 = int(round(r2 + k * (1.0 - s1 - e2)))
+        ratings[i] = r1
+        ratings[j] = r2
+        if r1 > peaks[i]:
+            peaks[i] = r1
+        if r2 > peaks[j]:
+            peaks[j] = r2
+        n += 1
+
+    return {
+        "ids": [uid for uid, _r in users],
+        "old": [r for _uid, r in users],
+        "new": ratings,
+        "peaks": peaks,
+        "matches": n,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def write_replayed_ratings(result: Dict) -> int:
+    """
+    Одна транзакция: bulk UPDATE рейтингов (только изменившихся) и пиков в user_stats.
+    """
+    changed = [
+        {"id": uid, "rating": new}
+        for uid, old, new in zip(result["ids"], result["old"], result["new"])
+        if old != new
+    ]
+    if changed:
+        db.session.execute(update(AuthUser), changed)
+    with_stats = {uid for (uid,) in db.session.query(UserStats.user_id)}
+    peaks = [
+        {"user_id": uid, "peak_rating": peak}
+        for uid, peak in zip(result["ids"], result["peaks"])
+        if uid in with_stats
+    ]
+    if peaks:
+        db.session.execute(update(UserStats), peaks)
+    db.session.commit()
+    return len(changed)
+
+
+@app.cli.command("replay-elo")
+@click.option("--k", "k", type=int, default=None, help="K-фактор (по умолчанию ELO_K).")
+@click.option("--start", type=int, default=ELO_START, show_default=True, help="Стартовый рейтинг.")
+@click.option("--dry-run", is_flag=True, help="Только показать разницу, ничего не записывать.")
+@click.option("--show", type=int, default=20, show_default=True, help="Сколько самых больших изменений вывести.")
+def replay_elo_command(k, start, dry_run, show):
+    """Пересчитать рейтинги по истории матчей (например, после смены ELO_K)."""
+    k = k if k is not None else int(app.config.get("ELO_K", 32))
+    result = replay_elo(k, start)
+    diffs = [
+        (new - old, uid, old, new)
+        for uid, old, new in zip(result["ids"], result["old"], result["new"])
+        if old != new
+    ]
+    click.echo(
+        f"replayed {result['matches']} matches for {len(result['ids'])} users "
+        f"in {result['seconds']}s (K={k}); changed: {len(diffs)}"
+    )
+    if diffs:
+        names = dict(db.session.query(AuthUser.id, AuthUser.username))
+        diffs.sort(key=lambda x: -abs(x[0]))
+        for delta, uid, old, new in diffs[:show]:
+            click.echo(f"  {names.get(uid, uid)}: {old} -> {new} ({delta:+d})")
+
+    if dry_run:
+        click.echo("dry run: nothing written")
+        return
+    n = write_replayed_ratings(result)
+    click.echo(f"updated ratings: {n}")
+
+
 # ----------------------------
 # Matchmaking queue (in-memory)
 # ----------------------------
@@ -118,8 +882,696 @@ class QueueEntry:
     joined_at: float
 
 
-WAITING: List[QueueEntry] = []
-LIVE_MATCHES: Dict[int, Dict] = {}
+class MatchQueue:
+    """
+    Очередь поиска, упорядоченная по рейтингу.
+    keys — отсортированный список (rating, seq), по нему ищем ближайший рейтинг бисекцией.
+    Удаление — O(1): запись убирается из хэш-индексов, а ключ в keys остаётся
+    "мёртвым" до ближайшей компактификации.
+    """
+
+    def __init__(self):
+        self.keys: List[Tuple[int, int]] = []
+        self.entries: Dict[int, QueueEntry] = {}  # seq -> entry
+        self.by_user: Dict[int, int] = {}  # user_id -> seq
+        self.by_sid: Dict[str, int] = {}  # sid -> seq
+        self.next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        """
+        Живые записи по возрастанию рейтинга (при равенстве — по времени входа).
+        """
+        for _rating, seq in self.keys:
+            e = self.entries.get(seq)
+            if e is not None:
+                yield e
+
+    def add(self, entry: QueueEntry):
+        self.remove_user(entry.user_id)
+        self.remove_sid(entry.sid)
+        seq = self.next_seq
+        self.next_seq += 1
+        self.entries[seq] = entry
+        self.by_user[entry.user_id] = seq
+        self.by_sid[entry.sid] = seq
+        bisect.insort(self.keys, (entry.rating, seq))
+
+    def _remove_seq(self, seq: Optional[int]) -> Optional[QueueEntry]:
+        if seq is None:
+            return None
+        e = self.entries.pop(seq, None)
+        if e is None:
+            return None
+        if self.by_user.get(e.user_id) == seq:
+            del self.by_user[e.user_id]
+        if self.by_sid.get(e.sid) == seq:
+            del self.by_sid[e.sid]
+        # компактификация, когда мёртвых ключей больше, чем живых
+        if len(self.keys) > 64 and len(self.keys) > 2 * len(self.entries):
+            self.keys = [k for k in self.keys if k[1] in self.entries]
+        return e
+
+    def remove_user(self, user_id: int) -> Optional[QueueEntry]:
+        return self._remove_seq(self.by_user.get(user_id))
+
+    def remove_sid(self, sid: str) -> Optional[QueueEntry]:
+        return self._remove_seq(self.by_sid.get(sid))
+
+    def _live(self, i: int, exclude_user: int) -> bool:
+        e = self.entries.get(self.keys[i][1])
+        return e is not None and e.user_id != exclude_user
+
+    def nearest(self, rating: int, exclude_user: int) -> Optional[QueueEntry]:
+        """
+        Запись с ближайшим рейтингом; при равной разнице — та, что встала в очередь раньше.
+        """
+        keys = self.keys
+        split = bisect.bisect_right(keys, (rating, float("inf")))
+
+        lo = split - 1
+        while lo >= 0 and not self._live(lo, exclude_user):
+            lo -= 1
+        hi = split
+        while hi < len(keys) and not self._live(hi, exclude_user):
+            hi += 1
+
+        candidates = []
+        if lo >= 0:
+            candidates.append(keys[lo][0])
+        if hi < len(keys):
+            candidates.append(keys[hi][0])
+        if not candidates:
+            return None
+
+        best_diff = min(abs(r - rating) for r in candidates)
+        best = None
+        for r in candidates:
+            if abs(r - rating) != best_diff:
+                continue
+            # самая ранняя живая запись с этим рейтингом
+            i = bisect.bisect_left(keys, (r, -1))
+            while not self._live(i, exclude_user):
+                i += 1
+            if best is None or keys[i][1] < best[1]:
+                best = keys[i]
+        return self.entries[best[1]]
+
+
+# ----------------------------
+# Live sessions (компактные объекты состояния)
+# ----------------------------
+class Submission:
+    """
+    Последний ответ игрока в матче; verdict считается один раз при отправке.
+    """
+
+    __slots__ = ("answer", "ts", "first_ts", "first_correct_ts", "correct")
+
+    def __init__(
+        self, answer: str = "", ts: float = 0.0, first_ts: float = 0.0, first_correct_ts=None, correct=False
+    ):
+        self.answer = answer
+        self.ts = ts
+        self.first_ts = first_ts
+        self.first_correct_ts = first_correct_ts
+        self.correct = correct
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class LiveMatch:
+    """
+    Живой матч. task — общая запись TaskRecord из TASK_INDEX, не копия.
+    """
+
+    __slots__ = (
+        "p1_id",
+        "p2_id",
+        "p1_name",
+        "p2_name",
+        "p1_sid",
+        "p2_sid",
+        "seconds_left",
+        "deadline",
+        "running",
+        "task",
+        "submissions",
+        "created_at",
+    )
+
+    def __init__(self, p1_id: int, p2_id: int, p1_name: str, p2_name: str, seconds_left: int, task):
+        self.p1_id = p1_id
+        self.p2_id = p2_id
+        self.p1_name = p1_name
+        self.p2_name = p2_name
+        self.p1_sid: Optional[str] = None
+        self.p2_sid: Optional[str] = None
+        self.seconds_left = seconds_left
+        self.deadline: Optional[float] = None
+        self.running = False
+        self.task = task
+        self.submissions: Dict[int, Submission] = {}
+        self.created_at = time.time()  # для REAPER: матч, который так и не начался
+
+    def to_dict(self) -> Dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["task"] = self.task.to_dict()
+        data["submissions"] = {uid: sub.to_dict() for uid, sub in self.submissions.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LiveMatch":
+        m = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(m, name, data.get(name))
+        m.task = intern_task(data["task"])
+        # ключи JSON — строки, а submissions индексируются user_id
+        m.submissions = {int(uid): Submission(**sub) for uid, sub in (data.get("submissions") or {}).items()}
+        return m
+
+
+class LiveTraining:
+    """
+    Живая тренировка. Счётчики и фильтры — поля объекта, а не вложенные dict;
+    колода — список ссылок на TaskRecord.
+    """
+
+    __slots__ = (
+        "user_id",
+        "username",
+        "room",
+        "sid",
+        "running",
+        "seconds_left",
+        "deadline",
+        "task",
+        "total",
+        "solved",
+        "subject",
+        "topic",
+        "difficulty",
+        "generation",
+        "deck",
+        "seen",
+        "deck_refilling",
+        "touched_at",
+    )
+
+    def __init__(self, user_id: int, username: str, room: str, sid: str, seconds_left: int):
+        self.user_id = user_id
+        self.username = username
+        self.room = room
+        self.sid = sid
+        self.running = True
+        self.seconds_left = seconds_left
+        self.deadline: Optional[float] = None
+        self.task = None
+        self.total = 0
+        self.solved = 0
+        # дефолтные фильтры
+        self.subject = "Любой"
+        self.topic = "Любая"
+        self.difficulty = "Любая"
+        self.generation = 0  # защита от дубля таймеров
+        self.deck: List = []
+        self.seen: set = set()
+        self.deck_refilling = False
+        self.touched_at = time.time()  # последнее действие игрока (для REAPER)
+
+    def stats(self) -> Dict:
+        return {"total": self.total, "solved": self.solved}
+
+    def filters(self) -> Dict:
+        return {"subject": self.subject, "topic": self.topic, "difficulty": self.difficulty}
+
+    def to_dict(self) -> Dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["task"] = self.task.to_dict() if self.task is not None else None
+        data["deck"] = [t.id for t in self.deck]
+        data["seen"] = list(self.seen)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LiveTraining":
+        tr = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(tr, name, data.get(name))
+        tr.task = intern_task(data["task"]) if data.get("task") else None
+        # выключенные/удалённые задачи из колоды просто выпадают
+        tr.deck = [TASK_INDEX.tasks[tid] for tid in data.get("deck") or () if tid in TASK_INDEX.tasks]
+        tr.seen = set(data.get("seen") or ())
+        return tr
+
+
+def approx_bytes(obj, seen: set) -> int:
+    """
+    Примерный размер объекта сессии вместе с вложенными контейнерами.
+    TaskRecord не считаем — это общие записи TASK_INDEX, их размер отдельно.
+    """
+    if id(obj) in seen or isinstance(obj, TaskRecord):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_bytes(k, seen) + approx_bytes(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approx_bytes(v, seen) for v in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(approx_bytes(getattr(obj, name, None), seen) for name in obj.__slots__)
+    return size
+
+
+# размер считаем по выборке сессий и умножаем на их число
+LIVE_MEMORY_SAMPLE = 500
+
+
+def live_memory_stats() -> Dict:
+    """
+    Число живых сессий и их примерный объём в памяти (байты) — для /admin/metrics.json.
+    """
+    out = {}
+    for name, table in (("matches", LIVE_MATCHES), ("trainings", LIVE_TRAININGS)):
+        sessions = list(table.values())
+        sample = random.sample(sessions, LIVE_MEMORY_SAMPLE) if len(sessions) > LIVE_MEMORY_SAMPLE else sessions
+        per = sum(approx_bytes(st, set()) for st in sample) / len(sample) if sample else 0.0
+        out[name] = {"count": len(sessions), "avg_bytes": int(per), "bytes": int(per * len(sessions))}
+
+    shared = set()
+    out["tasks"] = {
+        "count": len(TASK_INDEX.tasks),
+        "bytes": sum(
+            sys.getsizeof(rec) + sum(approx_bytes(getattr(rec, name), shared) for name in rec.__slots__)
+            for rec in TASK_INDEX.tasks.values()
+        ),
+    }
+    return out
+
+
+# ----------------------------
+# Live state store (очередь, матчи, тренировки)
+# ----------------------------
+# имя этого процесса для аренды (leases) в общем хранилище
+LIVE_OWNER = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+
+
+class MemoryTable(dict):
+    """
+    Таблица живых состояний в памяти процесса: обычный dict,
+    get() отдаёт тот же объект, поэтому save() и locked() ничего не делают.
+    """
+
+    def save(self, key, state):
+        self[key] = state
+
+    def locked(self, _key):
+        return nullcontext()
+
+
+class MemoryStore:
+    """
+    Хранилище по умолчанию: всё в памяти одного процесса.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.tables: Dict[str, MemoryTable] = {}
+        self.claims: Dict[str, float] = {}
+
+    def table(self, kind: str, decode=None) -> MemoryTable:
+        return self.tables.setdefault(kind, MemoryTable())
+
+    def queue(self):
+        return MatchQueue()
+
+    def claim(self, token: str, ttl: float = 3600.0) -> bool:
+        """
+        Одноразовая отметка "уже обработано": True только у первого вызова за ttl.
+        """
+        now = time.time()
+        if self.claims.get(token, 0.0) > now:
+            return False
+        if len(self.claims) > 1024:
+            self.claims = {t: exp for t, exp in self.claims.items() if exp > now}
+        self.claims[token] = now + ttl
+        return True
+
+    def claimed(self, token: str) -> bool:
+        return self.claims.get(token, 0.0) > time.time()
+
+    def lease(self, name: str, ttl: float, owner: str = LIVE_OWNER) -> bool:
+        return True
+
+    def stats(self) -> Dict:
+        return {"backend": "memory", **{kind: len(t) for kind, t in self.tables.items()}}
+
+
+def _live_json_default(obj):
+    if isinstance(obj, set):
+        return sorted(obj)
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    if is_dataclass(obj):
+        return asdict(obj)
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+class SqliteTable:
+    """
+    Таблица живых состояний в общем SQLite-файле (строка = JSON состояния).
+    get() отдаёт копию: после изменения её нужно вернуть через save(),
+    а изменения, которые могут прийти из двух воркеров сразу, делать под locked().
+    """
+
+    def __init__(self, store: "SqliteStore", kind: str, decode=None):
+        self.store = store
+        self.kind = kind
+        self.decode = decode
+
+    def _load(self, data: str):
+        state = json.loads(data)
+        return self.decode(state) if self.decode else state
+
+    def get(self, key, default=None):
+        row = self.store.execute(
+            "SELECT data FROM live_state WHERE kind = ? AND key = ?", (self.kind, str(key))
+        ).fetchone()
+        return self._load(row[0]) if row else default
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __setitem__(self, key, state):
+        self.save(key, state)
+
+    def save(self, key, state):
+        self.store.execute(
+            "INSERT INTO live_state(kind, key, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (self.kind, str(key), json.dumps(state, default=_live_json_default), time.time()),
+        )
+
+    def setdefault(self, key, state):
+        """
+        Вставка, только если состояния ещё нет; возвращает то, что в итоге лежит в таблице.
+        """
+        self.store.execute(
+            "INSERT OR IGNORE INTO live_state(kind, key, data, updated_at) VALUES (?, ?, ?, ?)",
+            (self.kind, str(key), json.dumps(state, default=_live_json_default), time.time()),
+        )
+        return self.get(key)
+
+    def pop(self, key, default=None):
+        row = self.store.execute(
+            "DELETE FROM live_state WHERE kind = ? AND key = ? RETURNING data", (self.kind, str(key))
+        ).fetchone()
+        return self._load(row[0]) if row else default
+
+    def items(self):
+        rows = self.store.execute(
+            "SELECT key, data FROM live_state WHERE kind = ? ORDER BY key", (self.kind,)
+        ).fetchall()
+        return [(int(key), self._load(data)) for key, data in rows]
+
+    def values(self):
+        return [state for _key, state in self.items()]
+
+    def scan(self, after: Optional[str] = None, before: Optional[str] = None, reverse: bool = False, limit: int = 8):
+        """
+        До limit строк с ключом строго между after и before, по порядку ключа
+        (ключи сравниваются как строки) — диапазон по первичному ключу, без полного прохода.
+        """
+        sql = "SELECT key, data FROM live_state WHERE kind = ?"
+        params = [self.kind]
+        if after is not None:
+            sql += " AND key > ?"
+            params.append(after)
+        if before is not None:
+            sql += " AND key < ?"
+            params.append(before)
+        sql += " ORDER BY key DESC LIMIT ?" if reverse else " ORDER BY key LIMIT ?"
+        params.append(limit)
+        return [(key, self._load(data)) for key, data in self.store.execute(sql, params).fetchall()]
+
+    def __len__(self) -> int:
+        return self.store.execute(
+            "SELECT COUNT(*) FROM live_state WHERE kind = ?", (self.kind,)
+        ).fetchone()[0]
+
+    def locked(self, key):
+        return self.store.lock(f"{self.kind}:{key}")
+
+
+class SharedQueue:
+    """
+    Очередь поиска в общем хранилище: запись на игрока (ключ — user_id).
+    Интерфейс как у MatchQueue. Рядом два индекса в том же хранилище:
+    by_sid (sid -> user_id) — выход по sid одним удалением по ключу,
+    by_rating (ключ "рейтинг:время входа:user_id" -> user_id) — ближайший
+    соперник диапазонным запросом по ключу, без разбора всей очереди.
+    Источник правды — сама очередь: устаревшие строки индексов
+    (воркер упал между записями) пропускаются и подчищаются при чтении.
+    """
+
+    RATING_OFFSET = 10**9  # ключ без знака: сортировка строк = сортировка рейтингов
+    SCAN_BATCH = 8
+
+    def __init__(self, table: SqliteTable, by_sid: SqliteTable, by_rating: SqliteTable):
+        self.table = table
+        self.by_sid = by_sid
+        self.by_rating = by_rating
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __iter__(self):
+        entries = self.table.values()
+        entries.sort(key=lambda e: (e.rating, e.joined_at))
+        return iter(entries)
+
+    @classmethod
+    def _rating_prefix(cls, rating: int) -> str:
+        return f"{rating + cls.RATING_OFFSET:010d}"
+
+    @classmethod
+    def _rating_key(cls, e: QueueEntry) -> str:
+        return f"{cls._rating_prefix(e.rating)}:{e.joined_at:017.6f}:{e.user_id:010d}"
+
+    def add(self, entry: QueueEntry):
+        self.remove_sid(entry.sid)
+        self.remove_user(entry.user_id)
+        self.table[entry.user_id] = entry
+        self.by_sid[entry.sid] = entry.user_id
+        self.by_rating[self._rating_key(entry)] = entry.user_id
+
+    def remove_user(self, user_id: int) -> Optional[QueueEntry]:
+        e = self.table.pop(user_id)
+        if e is not None:
+            self.by_rating.pop(self._rating_key(e))
+            if self.by_sid.get(e.sid) == user_id:
+                self.by_sid.pop(e.sid)
+        return e
+
+    def remove_sid(self, sid: str) -> Optional[QueueEntry]:
+        user_id = self.by_sid.pop(sid)
+        if user_id is None:
+            return None
+        e = self.table.get(user_id)
+        if e is None or e.sid != sid:
+            return None
+        return self.remove_user(user_id)
+
+    def _first(self, exclude_user: int, after=None, before=None, reverse=False) -> Optional[QueueEntry]:
+        """
+        Первая живая запись индекса by_rating в диапазоне, кроме exclude_user.
+        """
+        while True:
+            rows = self.by_rating.scan(after, before, reverse, limit=self.SCAN_BATCH)
+            for key, user_id in rows:
+                e = self.table.get(user_id)
+                if e is None or self._rating_key(e) != key:
+                    self.by_rating.pop(key)
+                elif user_id != exclude_user:
+                    return e
+            if len(rows) < self.SCAN_BATCH:
+                return None
+            if reverse:
+                before = rows[-1][0]
+            else:
+                after = rows[-1][0]
+
+    def nearest(self, rating: int, exclude_user: int) -> Optional[QueueEntry]:
+        """
+        Запись с ближайшим рейтингом; при равной разнице — та, что встала в очередь раньше.
+        """
+        split = self._rating_prefix(rating + 1)
+        lo = self._first(exclude_user, before=split, reverse=True)
+        if lo is not None:
+            # самая ранняя запись с этим рейтингом
+            lo = self._first(
+                exclude_user, after=self._rating_prefix(lo.rating), before=self._rating_prefix(lo.rating + 1)
+            )
+        hi = self._first(exclude_user, after=split)
+
+        candidates = [e for e in (lo, hi) if e is not None]
+        if not candidates:
+            return None
+        best_diff = min(abs(e.rating - rating) for e in candidates)
+        return min((e for e in candidates if abs(e.rating - rating) == best_diff), key=lambda e: e.joined_at)
+
+
+class SqliteStore:
+    """
+    Общее хранилище для нескольких воркеров на одном хосте: один SQLite-файл в WAL.
+    Запросы короткие (по первичному ключу), поэтому идут прямо из гринлета.
+    Но ждать занятую БД внутри sqlite3 нельзя — встанет весь хаб: busy_timeout
+    у соединения нулевой, а повтор с паузой делает execute через socketio.sleep.
+    claim — одноразовые отметки (защита от повторной обработки),
+    lease — аренда с истечением (единственный подборщик, блокировки состояний).
+    """
+
+    shared = True
+    LOCK_TTL = 5.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.pid = None
+        self.claims = 0
+        self.lock_seq = 0
+        self.busy_retries = 0
+
+    def connect(self) -> sqlite3.Connection:
+        # после fork у воркера должно быть своё соединение
+        if self.conn is None or self.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path,
+                timeout=app.config["SQLITE_BUSY_TIMEOUT_MS"] / 1000.0,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS live_state (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (kind, key)
+                );
+                CREATE TABLE IF NOT EXISTS live_claims (
+                    token TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS live_leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                """
+            )
+            # дальше занятая БД — сразу SQLITE_BUSY, ждём в execute
+            conn.execute("PRAGMA busy_timeout = 0")
+            self.conn, self.pid = conn, os.getpid()
+        return self.conn
+
+    def execute(self, sql: str, params=()):
+        conn = self.connect()
+        delay = 0.001
+        deadline = None
+        while True:
+            try:
+                return conn.execute(sql, params)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + app.config["SQLITE_BUSY_TIMEOUT_MS"] / 1000.0
+                if now >= deadline:
+                    raise
+                self.busy_retries += 1
+                socketio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    def table(self, kind: str, decode=None) -> SqliteTable:
+        return SqliteTable(self, kind, decode)
+
+    def queue(self) -> SharedQueue:
+        return SharedQueue(
+            self.table("queue", decode=lambda d: QueueEntry(**d)), self.table("queue_sid"), self.table("queue_rating")
+        )
+
+    def claim(self, token: str, ttl: float = 3600.0) -> bool:
+        now = time.time()
+        self.claims += 1
+        if self.claims % 256 == 0:
+            self.execute("DELETE FROM live_claims WHERE expires_at <= ?", (now,))
+        else:
+            self.execute("DELETE FROM live_claims WHERE token = ? AND expires_at <= ?", (token, now))
+        cur = self.execute(
+            "INSERT OR IGNORE INTO live_claims(token, expires_at) VALUES (?, ?)", (token, now + ttl)
+        )
+        return cur.rowcount == 1
+
+    def claimed(self, token: str) -> bool:
+        row = self.execute(
+            "SELECT 1 FROM live_claims WHERE token = ? AND expires_at > ?", (token, time.time())
+        ).fetchone()
+        return row is not None
+
+    def lease(self, name: str, ttl: float, owner: str = LIVE_OWNER) -> bool:
+        """
+        Взять или продлить аренду name на ttl сек; False — она у другого владельца.
+        """
+        now = time.time()
+        cur = self.execute(
+            "INSERT INTO live_leases(name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE live_leases.owner = excluded.owner OR live_leases.expires_at <= ?",
+            (name, owner, now + ttl, now),
+        )
+        return cur.rowcount == 1
+
+    def release(self, name: str, owner: str = LIVE_OWNER):
+        self.execute("DELETE FROM live_leases WHERE name = ? AND owner = ?", (name, owner))
+
+    @contextmanager
+    def lock(self, name: str):
+        # владелец — конкретный захват, а не процесс: гринлеты одного воркера тоже ждут друг друга
+        name = f"lock:{name}"
+        self.lock_seq += 1
+        owner = f"{LIVE_OWNER}:{self.lock_seq}"
+        while not self.lease(name, self.LOCK_TTL, owner):
+            socketio.sleep(0.01)
+        try:
+            yield
+        finally:
+            self.release(name, owner)
+
+    def stats(self) -> Dict:
+        rows = self.execute("SELECT kind, COUNT(*) FROM live_state GROUP BY kind").fetchall()
+        return {"backend": "sqlite", "path": self.path, "busy_retries": self.busy_retries, **dict(rows)}
+
+
+def make_live_store():
+    backend = app.config.get("LIVE_STORE", "memory")
+    if backend == "sqlite":
+        return SqliteStore(app.config["LIVE_STORE_PATH"])
+    if backend != "memory":
+        raise RuntimeError(f"unknown LIVE_STORE: {backend}")
+    return MemoryStore()
+
+
+LIVE_STORE = make_live_store()
+WAITING = LIVE_STORE.queue()
+LIVE_MATCHES = LIVE_STORE.table("match", decode=LiveMatch.from_dict)
 
 
 def match_room(match_id: int) -> str:
@@ -127,32 +1579,65 @@ def match_room(match_id: int) -> str:
 
 
 def remove_from_queue_by_user(user_id: int):
-    global WAITING
-    WAITING = [e for e in WAITING if e.user_id != user_id]
+    WAITING.remove_user(user_id)
 
 
 def remove_from_queue_by_sid(sid: str):
-    global WAITING
-    WAITING = [e for e in WAITING if e.sid != sid]
+    WAITING.remove_sid(sid)
 
 
 def find_best_opponent(entry: QueueEntry) -> Optional[QueueEntry]:
-    best = None
-    best_diff = None
-    for e in WAITING:
-        if e.user_id == entry.user_id:
-            continue
-        diff = abs(e.rating - entry.rating)
-        if best is None or diff < best_diff:
-            best = e
-            best_diff = diff
-    return best
+    return WAITING.nearest(entry.rating, exclude_user=entry.user_id)
+
+
+def match_window(entry: QueueEntry, now: float) -> float:
+    """
+    Допустимая разница рейтингов для записи: растёт со временем ожидания.
+    """
+    base = app.config.get("MATCH_WINDOW_BASE", 50)
+    growth = app.config.get("MATCH_WINDOW_GROWTH", 10)
+    cap = app.config.get("MATCH_WINDOW_MAX", 1000)
+    return min(cap, base + growth * max(0.0, now - entry.joined_at))
+
+
+def plan_pairs(entries: List[QueueEntry], now: float) -> List[Tuple[QueueEntry, QueueEntry]]:
+    """
+    Глобальный подбор пар по очереди, отсортированной по рейтингу.
+    Пара допустима, если разница укладывается в окно хотя бы одного из игроков
+    (дольше ждущий соглашается на более далёкого соперника).
+    Пары составляем из соседей по рейтингу, DP за O(n): максимум таких пар,
+    а при равенстве — минимум суммарной разницы рейтингов.
+    """
+    n = len(entries)
+    windows = [match_window(e, now) for e in entries]
+    # best[i] = (пар, -сумма разниц) для первых i записей
+    best: List[Tuple[int, int]] = [(0, 0)] * (n + 1)
+    paired = [False] * (n + 1)
+    for i in range(2, n + 1):
+        a, b = entries[i - 2], entries[i - 1]
+        best[i] = best[i - 1]
+        diff = b.rating - a.rating
+        if a.user_id != b.user_id and diff <= max(windows[i - 2], windows[i - 1]):
+            cand = (best[i - 2][0] + 1, best[i - 2][1] - diff)
+            if cand > best[i]:
+                best[i] = cand
+                paired[i] = True
+
+    pairs = []
+    i = n
+    while i >= 2:
+        if paired[i]:
+            pairs.append((entries[i - 2], entries[i - 1]))
+            i -= 2
+        else:
+            i -= 1
+    return pairs
 
 
 # ----------------------------
 # Training (in-memory)
 # ----------------------------
-LIVE_TRAININGS: Dict[int, Dict] = {}
+LIVE_TRAININGS = LIVE_STORE.table("training", decode=LiveTraining.from_dict)
 
 
 def training_room(user_id: int) -> str:
@@ -169,6 +1654,11 @@ def normalize_filter_value(val: str, any_value: str) -> str:
     return v if v else any_value
 
 
+# колода задач тренировки: перемешанная, без повторов, добирается заранее
+TRAINING_DECK_SIZE = 20
+TRAINING_DECK_LOW = 5
+
+
 # ----------------------------
 # Tasks logic (server-side)
 # ----------------------------
@@ -176,98 +1666,925 @@ def normalize_answer(s: str) -> str:
     return (s or "").strip().replace(",", ".").lower()
 
 
-def is_correct(submitted: str, correct: str) -> bool:
-    return normalize_answer(submitted) == normalize_answer(correct)
+# порядок больше — не ответ ЕГЭ; такие "числа" сравниваем как текст
+CANON_NUMBER_MAX_EXP = 100
+
+
+def canon_number(s: str):
+    """
+    Число в каноническом виде: "0.50", ".5" и "0,5" — одно и то же.
+    Не число (или число с огромным порядком вроде 9e999999999) — сравниваем как текст.
+    """
+    text = normalize_answer(s).replace(" ", "")
+    try:
+        d = Decimal(text)
+        if not d.is_finite() or abs(d.adjusted()) > CANON_NUMBER_MAX_EXP:
+            return text
+        return "0" if d == 0 else format(d.normalize(), "f")
+    except DecimalException:
+        return text
+
+
+def canon_set(s: str):
+    """
+    Ответ "в любом порядке": "135", "1;3;5" и "5 3 1" — одно и то же.
+    Повторы значимы: "1135" — не "135" (отсортированный кортеж, а не множество).
+    """
+    text = (s or "").strip().lower()
+    tokens = [t for t in re.split(r"[\s,;]+", text) if t]
+    if len(tokens) == 1:
+        tokens = list(tokens[0])
+    return tuple(sorted(tokens))
+
+
+ANSWER_CANON = {"number": canon_number, "set": canon_set}
+
+
+class AnswerMatcher:
+    """
+    Проверка ответа, скомпилированная один раз на задачу: канонический вид
+    правильного ответа (по kind) и всех его вариантов через "|".
+    """
+
+    __slots__ = ("canon", "accepted")
+
+    def __init__(self, kind: str, answer: str):
+        self.canon = ANSWER_CANON.get(kind, normalize_answer)
+        self.accepted = frozenset(self.canon(alt) for alt in (answer or "").split("|") if alt.strip())
+
+    def __call__(self, submitted: str) -> bool:
+        return self.canon(submitted) in self.accepted
+
+
+def _intern(val):
+    return sys.intern(val) if isinstance(val, str) else val
+
+
+class TaskRecord:
+    """
+    Задача в памяти: одна запись на задачу в TASK_INDEX; колоды и сессии держат
+    ссылку на неё, а не копию prompt/answer. Запись не меняется — при правке
+    задачи в индекс кладётся новая.
+    """
+
+    FIELDS = ("id", "subject", "topic", "prompt", "answer", "kind", "difficulty")
+    __slots__ = FIELDS + ("check",)
+
+    def __init__(self, id, subject, topic, prompt, answer, kind, difficulty):
+        self.id = id
+        # предметы/темы/сложности повторяются у тысяч задач — держим по одной строке
+        self.subject = _intern(subject)
+        self.topic = _intern(topic)
+        self.prompt = prompt
+        self.answer = answer
+        self.kind = _intern(kind)
+        self.difficulty = _intern(difficulty)
+        self.check = AnswerMatcher(kind, answer)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def task_record(t: Task) -> TaskRecord:
+    return TaskRecord(
+        t.id, getattr(t, "subject", DEFAULT_SUBJECT), t.topic, t.prompt, t.answer, t.kind, t.difficulty
+    )
 
 
-def pick_task() -> Dict[str, str]:
+def intern_task(data: Dict) -> TaskRecord:
     """
-    Берём активную задачу из БД. Если задач нет — возвращаем демо.
+    Задача сессии из общего хранилища: та же запись из TASK_INDEX, если задача не менялась.
+    """
+    rec = TASK_INDEX.tasks.get(data.get("id"))
+    if rec is not None and rec.prompt == data.get("prompt") and rec.answer == data.get("answer"):
+        return rec
+    return TaskRecord(**data)
+
+
+# ----------------------------
+# Task index (in-memory)
+# ----------------------------
+class TaskIndex:
+    """
+    Каталог активных задач в памяти процесса.
+    Каждая задача лежит в 8 корзинах: (subject|*, topic|*, difficulty|*),
+    поэтому случайная задача под любую комбинацию фильтров берётся за O(1)
+    без ORDER BY RANDOM() в БД. Удаление из корзины — swap-remove, тоже O(1).
+
+    Версия каталога общая для всех воркеров (лежит в LIVE_STORE): правка задач
+    в админке её меняет, остальные воркеры замечают это не позже чем через
+    CHECK_INTERVAL и перечитывают индекс. По ней же клиенты понимают, что
+    закэшированные опции фильтров устарели.
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self.loaded = False
+        self.stale = False
+        self.loaded_version = ""
+        self.checked_at = 0.0
+        self.reloads = 0
+        self.catalog = LIVE_STORE.table("catalog")
+        self.loading = Semaphore(1)
+        self.tasks: Dict[int, TaskRecord] = {}
+        self.buckets: Dict[Tuple, List[int]] = {}
+        self.positions: Dict[Tuple, Dict[int, int]] = {}
+
+    @staticmethod
+    def _keys(subject: str, topic: str, difficulty: str):
+        for s in (subject, None):
+            for t in (topic, None):
+                for d in (difficulty, None):
+                    yield (s, t, d)
+
+    def _add(self, rec: TaskRecord, tasks=None, buckets=None, positions=None):
+        tasks = self.tasks if tasks is None else tasks
+        buckets = self.buckets if buckets is None else buckets
+        positions = self.positions if positions is None else positions
+        task_id = rec.id
+        tasks[task_id] = rec
+        for key in self._keys(rec.subject, rec.topic, rec.difficulty):
+            bucket = buckets.setdefault(key, [])
+            positions.setdefault(key, {})[task_id] = len(bucket)
+            bucket.append(task_id)
+
+    @property
+    def version(self) -> str:
+        return self.loaded_version
+
+    def shared_version(self) -> str:
+        row = self.catalog.get("version")
+        if row is None:
+            row = self.catalog.setdefault("version", {"v": format(time.time_ns(), "x")})
+        return row["v"]
+
+    def bump(self):
+        """
+        Каталог изменился: новая общая версия. Свой индекс, если он был актуален,
+        правится на месте (upsert/discard) и остаётся актуальным.
+        """
+        current = self.loaded and not self.stale and self.shared_version() == self.loaded_version
+        version = format(time.time_ns(), "x")
+        self.catalog.save("version", {"v": version})
+        if current:
+            self.loaded_version = version
+
+    def discard(self, task_id: int):
+        self.bump()
+        self._discard(task_id)
+
+    def _discard(self, task_id: int):
+        rec = self.tasks.pop(task_id, None)
+        if not rec:
+            return
+        for key in self._keys(rec.subject, rec.topic, rec.difficulty):
+            bucket = self.buckets[key]
+            pos = self.positions[key].pop(task_id)
+            last = bucket.pop()
+            if last != task_id:
+                bucket[pos] = last
+                self.positions[key][last] = pos
+            if not bucket:
+                del self.buckets[key]
+                del self.positions[key]
+
+    def upsert(self, t: Task):
+        self.bump()
+        if not self.loaded:
+            return
+        self._discard(t.id)
+        if t.is_active:
+            self._add(task_record(t))
+
+    def invalidate(self):
+        # до перечитывания отдаём прежний индекс
+        self.bump()
+        self.stale = True
+
+    def _build(self):
+        """
+        Выборка и сборка корзин — в потоке run_db, хаб в это время не стоит.
+        """
+        tasks, buckets, positions = {}, {}, {}
+        rows = (
+            db.session.query(
+                Task.id, Task.subject, Task.topic, Task.prompt, Task.answer, Task.kind, Task.difficulty
+            )
+            .filter(Task.is_active.is_(True))
+            .all()
+        )
+        for r in rows:
+            rec = TaskRecord(r.id, r.subject, r.topic, r.prompt, r.answer, r.kind, r.difficulty)
+            self._add(rec, tasks, buckets, positions)
+        return tasks, buckets, positions
+
+    def load(self):
+        # кто-то уже перечитывает — пока отдаём прежний индекс
+        if self.loaded and self.loading.locked():
+            return
+        with self.loading:
+            version = self.shared_version()
+            if self.loaded and not self.stale and version == self.loaded_version:
+                return
+            # правка во время выборки снова пометит индекс устаревшим
+            self.stale = False
+            try:
+                self.tasks, self.buckets, self.positions = run_db(self._build)
+            except Exception:
+                self.stale = True
+                raise
+            self.loaded_version = version
+            self.loaded = True
+            self.checked_at = time.monotonic()
+            self.reloads += 1
+
+    def outdated(self) -> bool:
+        if not self.loaded or self.stale:
+            return True
+        now = time.monotonic()
+        if now - self.checked_at < self.CHECK_INTERVAL:
+            return False
+        self.checked_at = now
+        return self.shared_version() != self.loaded_version
+
+    def ensure_loaded(self):
+        if self.outdated():
+            self.load()
+
+    def pick(
+        self, subject: Optional[str] = None, topic: Optional[str] = None, difficulty: Optional[str] = None
+    ) -> Optional[TaskRecord]:
+        """
+        None = любое значение. Возвращает общую запись (или None, если корзина пуста).
+        """
+        self.ensure_loaded()
+        bucket = self.buckets.get((subject, topic, difficulty))
+        if not bucket:
+            return None
+        return self.tasks[random.choice(bucket)]
+
+    def sample(
+        self,
+        subject: Optional[str],
+        topic: Optional[str],
+        difficulty: Optional[str],
+        k: int,
+        exclude=(),
+    ) -> List[TaskRecord]:
+        """
+        До k разных задач из корзины в случайном порядке, пропуская exclude.
+        Маленькие корзины перемешиваем целиком, большие — выборкой с отбраковкой.
+        """
+        self.ensure_loaded()
+        bucket = self.buckets.get((subject, topic, difficulty))
+        if not bucket:
+            return []
+
+        if len(bucket) <= 4 * (k + len(exclude)):
+            ids = [tid for tid in bucket if tid not in exclude]
+            random.shuffle(ids)
+            ids = ids[:k]
+        else:
+            picked = set()
+            ids = []
+            for _ in range(4 * k):
+                tid = random.choice(bucket)
+                if tid in exclude or tid in picked:
+                    continue
+                picked.add(tid)
+                ids.append(tid)
+                if len(ids) >= k:
+                    break
+        return [self.tasks[tid] for tid in ids]
+
+    def count(self, subject: Optional[str] = None, topic: Optional[str] = None, difficulty: Optional[str] = None) -> int:
+        self.ensure_loaded()
+        return len(self.buckets.get((subject, topic, difficulty), ()))
+
+
+TASK_INDEX = TaskIndex()
+
+
+DEMO_TASK = TaskRecord(
+    None, DEFAULT_SUBJECT, "Демо-задача", "Сколько будет 17 + 25 ? (введите число)", "42", "number", DEFAULT_DIFFICULTY
+)
+
+
+def pick_task() -> TaskRecord:
+    """
+    Берём активную задачу из индекса. Если задач нет — возвращаем демо.
     ВАЖНО: сервер хранит correct answer, клиенту его не отдаем.
     """
-    t = Task.query.filter_by(is_active=True).order_by(func.random()).first()
+    t = TASK_INDEX.pick()
+
+    if not t:
+        return DEMO_TASK
+
+    return t
+
+
+def filters_key(subject: str, topic: str, difficulty: str) -> Tuple:
+    """
+    'Любой/Любая' -> None (ключ корзины TASK_INDEX).
+    """
+    return (
+        subject if subject and subject != "Любой" else None,
+        topic if topic and topic != "Любая" else None,
+        difficulty if difficulty and difficulty != "Любая" else None,
+    )
+
+
+def no_tasks_payload(subject: str, topic: str, difficulty: str) -> TaskRecord:
+    return TaskRecord(
+        None,
+        subject if subject != "Любой" else DEFAULT_SUBJECT,
+        topic if topic != "Любая" else "Нет задач",
+        "Нет задач под выбранные фильтры. Убери фильтры или добавь задачи в админке.",
+        "",
+        "text",
+        difficulty if difficulty != "Любая" else DEFAULT_DIFFICULTY,
+    )
 
+
+def pick_task_filtered(subject: str, topic: str, difficulty: str) -> TaskRecord:
+    """
+    subject/topic/difficulty могут быть 'Любой/Любая'.
+    """
+    t = TASK_INDEX.pick(*filters_key(subject, topic, difficulty))
     if not t:
+        return no_tasks_payload(subject, topic, difficulty)
+
+    return t
+
+
+# кэш опций тренировки: пересчитывается только при смене TASK_INDEX.version
+_TRAINING_OPTIONS: Dict = {"version": None, "options": None}
+
+
+def training_options() -> Dict:
+    """
+    Возвращаем списки для селектов тренировки + количество активных задач
+    по каждой комбинации фильтров (чтобы клиент мог серить пустые варианты).
+    """
+    TASK_INDEX.ensure_loaded()
+    version = TASK_INDEX.version
+    if _TRAINING_OPTIONS["version"] == version:
+        return _TRAINING_OPTIONS["options"]
+
+    # списки — из ключей корзин индекса: без DISTINCT-запросов к БД на хабе
+    subjects = sorted({s for (s, _t, _d) in TASK_INDEX.buckets if s})
+    topics = sorted({t for (_s, t, _d) in TASK_INDEX.buckets if t})
+
+    # [subject, topic, difficulty, n]; "Любой/Любая" — любое значение
+    counts = [
+        [s or "Любой", t or "Любая", d or "Любая", len(ids)]
+        for (s, t, d), ids in TASK_INDEX.buckets.items()
+    ]
+
+    options = {
+        "version": version,
+        "subjects": ["Любой"] + subjects,
+        "topics": ["Любая"] + topics,
+        "difficulties": ["Любая", "Легкая", "Средняя", "Сложная"],
+        "counts": counts,
+    }
+    _TRAINING_OPTIONS["version"] = version
+    _TRAINING_OPTIONS["options"] = options
+    return options
+
+
+# ----------------------------
+# Timers (один планировщик на все живые сессии)
+# ----------------------------
+class DeadlineScheduler:
+    """
+    Куча абсолютных дедлайнов (time.time()) вместо отдельного гринлета на каждый
+    матч/тренировку. Один цикл просыпается не реже раза в RESOLUTION сек,
+    запускает созревшие колбэки (каждый — ровно один раз) и раз в period сек
+    вызывает periodic. schedule() возвращает номер записи — по нему cancel()
+    снимает именно этот вызов; колбэк всё равно сам проверяет, что его
+    сессия/поколение ещё актуальны (таймер мог взвести другой воркер).
+    """
+
+    RESOLUTION = 0.25
+
+    def __init__(self, periodic=None, period: float = 1.0):
+        self.heap: List[Tuple[float, int, object, tuple]] = []
+        self.pending = set()  # номера записей, которые ещё сработают
+        self.seq = 0
+        self.started = False
+        self.periodic = periodic
+        self.period = period
+        self.fired = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+
+    def schedule(self, deadline: float, callback, *args) -> int:
+        handle = self.seq
+        self.seq += 1
+        heapq.heappush(self.heap, (deadline, handle, callback, args))
+        self.pending.add(handle)
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+        return handle
+
+    def cancel(self, handle: Optional[int]):
+        """
+        Снять вызов по номеру из schedule(). Уже сработавший или неизвестный номер — no-op.
+        Снятые записи выбрасываются из кучи, когда их станет больше половины.
+        """
+        if handle is None or handle not in self.pending:
+            return
+        self.pending.discard(handle)
+        if len(self.heap) > 64 and len(self.pending) * 2 < len(self.heap):
+            self.heap = [entry for entry in self.heap if entry[1] in self.pending]
+            heapq.heapify(self.heap)
+
+    def run(self):
+        period = self.period if self.periodic and self.period > 0 else None
+        next_periodic = time.time() + period if period else float("inf")
+        while True:
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, handle, callback, args = heapq.heappop(self.heap)
+                if handle not in self.pending:
+                    continue
+                self.pending.discard(handle)
+                lag = now - deadline
+                self.fired += 1
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+                self.lag_total += lag
+                socketio.start_background_task(callback, *args)
+
+            if now >= next_periodic:
+                next_periodic = max(next_periodic + period, now)
+                try:
+                    self.periodic()
+                except Exception:
+                    app.logger.exception("timer periodic hook failed")
+
+            wake = next_periodic
+            if self.heap:
+                wake = min(wake, self.heap[0][0])
+            socketio.sleep(min(self.RESOLUTION, max(0.0, wake - time.time())))
+
+    def stats(self) -> Dict:
         return {
-            "id": None,
-            "subject": DEFAULT_SUBJECT,
-            "topic": "Демо-задача",
-            "prompt": "Сколько будет 17 + 25 ? (введите число)",
-            "answer": "42",
-            "kind": "number",
-            "difficulty": DEFAULT_DIFFICULTY,
+            "scheduled": len(self.pending),
+            "cancelled": len(self.heap) - len(self.pending),
+            "fired": self.fired,
+            "lag_last_ms": round(self.lag_last * 1000, 1),
+            "lag_max_ms": round(self.lag_max * 1000, 1),
+            "lag_avg_ms": round(self.lag_total / self.fired * 1000, 1) if self.fired else 0.0,
         }
 
+
+def remaining_seconds(state) -> int:
+    """
+    Сколько секунд осталось у матча/тренировки: у запущенных считаем от дедлайна.
+    """
+    if state.running and state.deadline:
+        return max(0, int(math.ceil(state.deadline - time.time())))
+    return int(state.seconds_left or 0)
+
+
+def clock_payload(state) -> Dict:
+    """
+    Поля таймера для клиента: абсолютный дедлайн и текущее время сервера (мс),
+    по разнице клиент поправляет свои часы и дальше считает остаток сам.
+    """
+    running = bool(state.running and state.deadline)
     return {
-        "id": t.id,
-        "subject": getattr(t, "subject", DEFAULT_SUBJECT),
-        "topic": t.topic,
-        "prompt": t.prompt,
-        "answer": t.answer,
-        "kind": t.kind,
-        "difficulty": t.difficulty,
+        "seconds_left": remaining_seconds(state),
+        "deadline": int(state.deadline * 1000) if running else None,
+        "server_time": int(time.time() * 1000),
     }
 
 
-def pick_task_filtered(subject: str, topic: str, difficulty: str) -> Dict[str, str]:
+def broadcast_ticks():
     """
-    subject/topic/difficulty могут быть 'Любой/Любая'.
+    Редкая пересинхронизация часов клиентов (раз в TICK_RESYNC_SECONDS).
+    При общем хранилище тики шлёт один воркер.
     """
-    q = Task.query.filter_by(is_active=True)
+    if not LIVE_STORE.lease("ticks", 2 * float(app.config.get("TICK_RESYNC_SECONDS", 15))):
+        return
+    for match_id, state in list(LIVE_MATCHES.items()):
+        if state.running:
+            socketio.emit("match:tick", clock_payload(state), to=match_room(match_id))
+    for state in list(LIVE_TRAININGS.values()):
+        if state.running and state.deadline:
+            socketio.emit("training:tick", clock_payload(state), to=state.room)
 
-    if subject and subject != "Любой":
-        # если поля subject нет в модели/БД — здесь упадёт; это ожидаемо (нужно добавить колонку)
-        q = q.filter(Task.subject == subject)
 
-    if topic and topic != "Любая":
-        q = q.filter(Task.topic == topic)
+TIMERS = DeadlineScheduler(periodic=broadcast_ticks, period=Config.TICK_RESYNC_SECONDS)
+# номера записей TIMERS, взведённых этим воркером: match_id -> handle,
+# user_id -> (generation, handle)
+MATCH_TIMERS: Dict[int, int] = {}
+TRAINING_TIMERS: Dict[int, Tuple[int, int]] = {}
 
-    if difficulty and difficulty != "Любая":
-        q = q.filter(Task.difficulty == difficulty)
 
-    t = q.order_by(func.random()).first()
-    if not t:
+def arm_match_timer(match_id: int, deadline: float):
+    disarm_match_timer(match_id)
+    MATCH_TIMERS[match_id] = TIMERS.schedule(deadline, match_timeout, match_id)
+
+
+def disarm_match_timer(match_id: int):
+    TIMERS.cancel(MATCH_TIMERS.pop(match_id, None))
+
+
+def arm_training_timer(user_id: int, generation: int, deadline: float):
+    disarm_training_timer(user_id)
+    TRAINING_TIMERS[user_id] = (generation, TIMERS.schedule(deadline, training_timeout, user_id, generation))
+
+
+def disarm_training_timer(user_id: int):
+    _generation, handle = TRAINING_TIMERS.pop(user_id, (None, None))
+    TIMERS.cancel(handle)
+
+
+def resume_live_timers():
+    """
+    После рестарта воркера таймеры из общего хранилища взводим заново.
+    Если их взведут несколько воркеров, матч всё равно завершится один раз
+    (claim в finish_match), а у тренировки сработает только актуальное поколение.
+    """
+    for match_id, state in LIVE_MATCHES.items():
+        if state.running and state.deadline:
+            arm_match_timer(match_id, state.deadline)
+    for user_id, state in LIVE_TRAININGS.items():
+        if state.running and state.deadline:
+            arm_training_timer(user_id, state.generation, state.deadline)
+
+
+# ----------------------------
+# Match results (write-behind)
+# ----------------------------
+def result_to_dict(result: Dict) -> Dict:
+    ended_at = result.get("ended_at")
+    return {**result, "ended_at": ended_at.isoformat() if ended_at else None, "queued_at": time.time()}
+
+
+def result_from_dict(data: Dict) -> Dict:
+    if data.get("ended_at"):
+        data["ended_at"] = datetime.fromisoformat(data["ended_at"])
+    return data
+
+
+class MatchResultWriter:
+    """
+    Итоги матчей игрокам отдаём сразу, а в БД пишем отдельным гринлетом
+    небольшими пачками: одна транзакция на пачку (статус матча, Elo, user_stats).
+    Писатель один и берёт итоги строго по очереди, поэтому рейтинги игрока,
+    сыгравшего несколько матчей подряд, применяются в том же порядке.
+
+    При общем хранилище итог до коммита лежит ещё и в LIVE_STORE: если воркер
+    упадёт, не успев записать пачку, её допишет reaper (recover).
+    """
+
+    def __init__(self):
+        self.queue = deque()
+        self.pending_ids = set()
+        # игроки с ещё не записанным итогом: их рейтинг в БД пока старый
+        self.pending_users: Dict[int, int] = {}
+        self.durable = LIVE_STORE.table("result", decode=result_from_dict) if LIVE_STORE.shared else None
+        self.started = False
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.recovered = 0
+        self.last_batch_ms = 0.0
+
+    def submit(self, result: Dict):
+        self.pending_ids.add(result["match_id"])
+        for uid in (result["p1_id"], result["p2_id"]):
+            self.pending_users[uid] = self.pending_users.get(uid, 0) + 1
+        if self.durable is not None:
+            self.durable.save(result["match_id"], result_to_dict(result))
+        self.queue.append(result)
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def run(self):
+        interval = float(app.config.get("RESULTS_FLUSH_INTERVAL", 0.2))
+        while True:
+            socketio.sleep(interval)
+            if self.queue:
+                self.flush()
+
+    def flush(self):
+        batch_size = int(app.config.get("RESULTS_BATCH", 200))
+        while self.queue:
+            batch = [self.queue.popleft() for _ in range(min(batch_size, len(self.queue)))]
+            started = time.perf_counter()
+            try:
+                self.written_batch(batch, run_db(self.persist, batch))
+            except Exception:
+                app.logger.exception("match results batch failed, retrying one by one")
+                for result in batch:
+                    try:
+                        self.written_batch([result], run_db(self.persist, [result]))
+                    except Exception:
+                        self.failed += 1
+                        self.forget([result])
+                        app.logger.exception("match result %s dropped", result["match_id"])
+            self.last_batch_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.batches += 1
+
+    def persist(self, batch: List[Dict]) -> Dict[int, int]:
+        """
+        Пишет пачку одной транзакцией; возвращает новые рейтинги игроков.
+        Работает в потоке tpool — общее состояние процесса здесь не трогаем.
+        """
+        match_ids = [r["match_id"] for r in batch]
+        user_ids = {uid for r in batch for uid in (r["p1_id"], r["p2_id"])}
+        matches = {m.id: m for m in Match.query.filter(Match.id.in_(match_ids))}
+        users = {u.id: u for u in AuthUser.query.filter(AuthUser.id.in_(user_ids))}
+        k = int(app.config.get("ELO_K", 32))
+
+        for r in batch:
+            m = matches.get(r["match_id"])
+            # уже записан (например, повторно из recover) или списан reaper-ом
+            if not m or m.status in ("ended", "abandoned"):
+                continue
+            winner_user_id = r["winner_user_id"]
+
+            m.status = "ended"
+            m.ended_at = r["ended_at"]
+            m.winner_user_id = winner_user_id
+            m.reason = r["reason"]
+
+            p1 = users.get(m.player1_id)
+            p2 = users.get(m.player2_id)
+            if p1 and p2:
+                r1, r2 = int(p1.rating), int(p2.rating)
+
+                if winner_user_id == m.player1_id:
+                    s1, s2 = 1.0, 0.0
+                elif winner_user_id == m.player2_id:
+                    s1, s2 = 0.0, 1.0
+                else:
+                    s1, s2 = 0.5, 0.5
+
+                p1.rating = elo_apply(r1, r2, s1, k)
+                p2.rating = elo_apply(r2, r1, s2, k)
+
+            record_match_stats(m, {p.id: int(p.rating) for p in (p1, p2) if p})
+
+        db.session.commit()
+        return {u.id: int(u.rating) for u in users.values()}
+
+    def written_batch(self, batch: List[Dict], ratings: Dict[int, int]):
+        """
+        Пачка закоммичена: кэш профилей, индекс мест и счётчики — уже в гринлете.
+        """
+        USER_CACHE.invalidate(*{uid for r in batch for uid in (r["p1_id"], r["p2_id"])})
+        RATINGS.update_ratings(ratings)
+        self.forget(batch)
+        self.written += len(batch)
+
+    def forget(self, batch: List[Dict]):
+        for r in batch:
+            self.pending_ids.discard(r["match_id"])
+            for uid in (r["p1_id"], r["p2_id"]):
+                left = self.pending_users.get(uid, 0) - 1
+                if left > 0:
+                    self.pending_users[uid] = left
+                else:
+                    self.pending_users.pop(uid, None)
+            if self.durable is not None:
+                self.durable.pop(r["match_id"], None)
+
+    def recover(self, now: float) -> int:
+        """
+        Итоги в общем хранилище, которые давно никто не записал (воркер упал
+        между finish_match и коммитом пачки), — ставим в свою очередь.
+        Повторная запись безопасна: persist пропускает уже завершённые матчи.
+        """
+        if self.durable is None:
+            return 0
+        after = float(app.config.get("RESULTS_RECOVER_AFTER", 60))
+        n = 0
+        for match_id, result in self.durable.items():
+            queued_at = result.pop("queued_at", now)
+            if match_id in self.pending_ids or now - queued_at < after:
+                continue
+            self.submit(result)
+            n += 1
+        self.recovered += n
+        return n
+
+    def durable_ids(self) -> set:
+        return {match_id for match_id, _ in self.durable.items()} if self.durable is not None else set()
+
+    def wait_user(self, user_id: int, timeout: float) -> bool:
+        """
+        Ждём (не блокируя хаб), пока итоги матчей игрока не окажутся в БД.
+        False — не дождались за timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while self.pending_users.get(user_id):
+            if time.monotonic() >= deadline:
+                return False
+            socketio.sleep(0.02)
+        return True
+
+    def is_pending(self, match_id: int) -> bool:
+        """
+        Матч уже завершён в памяти, но ещё не записан в БД.
+        """
+        return match_id in self.pending_ids
+
+    def stats(self) -> Dict:
         return {
-            "id": None,
-            "subject": subject if subject != "Любой" else DEFAULT_SUBJECT,
-            "topic": topic if topic != "Любая" else "Нет задач",
-            "prompt": "Нет задач под выбранные фильтры. Убери фильтры или добавь задачи в админке.",
-            "answer": "",
-            "kind": "text",
-            "difficulty": difficulty if difficulty != "Любая" else DEFAULT_DIFFICULTY,
+            "pending": len(self.queue),
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "last_batch_ms": self.last_batch_ms,
         }
 
-    return {
-        "id": t.id,
-        "subject": getattr(t, "subject", DEFAULT_SUBJECT),
-        "topic": t.topic,
-        "prompt": t.prompt,
-        "answer": t.answer,
-        "kind": t.kind,
-        "difficulty": t.difficulty,
-    }
 
+MATCH_RESULTS = MatchResultWriter()
 
-def training_options() -> Dict:
+
+@atexit.register
+def flush_match_results_on_exit():
+    if MATCH_RESULTS.queue:
+        # хаб eventlet при выходе может быть уже остановлен — пишем напрямую
+        DB_EXECUTOR.mode = "inline"
+        MATCH_RESULTS.flush()
+
+
+# ----------------------------
+# Reaper (TTL живых сессий)
+# ----------------------------
+def db_interrupt_lost_matches(grace: int, keep: set) -> List[int]:
     """
-    Возвращаем списки для селектов тренировки.
+    Матчи "started", которые давно должны были закончиться, но живого состояния
+    и ждущего записи итога у них нет (процесс упал), — abandoned, без Elo.
     """
-    # subjects
-    try:
-        subjects_rows = db.session.query(Task.subject).distinct().order_by(Task.subject).all()
-        subjects = [r[0] for r in subjects_rows if r and r[0]]
-    except Exception:
-        # если subject ещё не добавили
-        subjects = [DEFAULT_SUBJECT]
+    now = datetime.utcnow()
+    rows = (
+        db.session.query(Match.id, Match.started_at, Match.duration_sec)
+        .filter(Match.status == "started", Match.started_at < now - timedelta(seconds=grace))
+        .all()
+    )
+    ids = [
+        r.id
+        for r in rows
+        if r.id not in keep and r.started_at + timedelta(seconds=(r.duration_sec or 0) + grace) < now
+    ]
+    if not ids:
+        return []
+    db.session.execute(
+        update(Match)
+        .where(Match.id.in_(ids), Match.status == "started")
+        .values(status="abandoned", ended_at=now, reason="interrupted")
+    )
+    db.session.commit()
+    return ids
 
-    topics_rows = db.session.query(Task.topic).distinct().order_by(Task.topic).all()
-    topics = [r[0] for r in topics_rows if r and r[0]]
 
-    return {
-        "subjects": ["Любой"] + subjects,
-        "topics": ["Любая"] + topics,
-        "difficulties": ["Любая", "Легкая", "Средняя", "Сложная"],
-    }
+def db_abandon_matches(match_ids: List[int]) -> List[int]:
+    """
+    Матчи, которые так и не начались, помечаем abandoned (только из pending).
+    Возвращает id действительно помеченных.
+    """
+    res = db.session.execute(
+        update(Match)
+        .where(Match.id.in_(match_ids), Match.status == "pending")
+        .values(status="abandoned", ended_at=datetime.utcnow(), reason="abandoned")
+        .returning(Match.id)
+    )
+    ids = [row[0] for row in res]
+    db.session.commit()
+    return ids
+
+
+class LiveReaper:
+    """
+    Фоновая уборка живого состояния раз в REAPER_INTERVAL сек:
+    - тренировки без действий игрока дольше TRAINING_IDLE_TTL (и остановленные,
+      и брошенные с открытой вкладкой — таймер крутит задачи сам);
+    - матчи, которые не начались за PENDING_MATCH_TTL (кто-то не зашёл), —
+      в БД abandoned, игрокам тост;
+    - записи очереди дольше QUEUE_TTL или с уже отключённым sid;
+    - итоги матчей упавших воркеров (MATCH_RESULTS.recover), а матчи, которые
+      после падения так и остались "started" без итога, — abandoned.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.runs = 0
+        self.evicted = {"trainings": 0, "matches": 0, "queue": 0, "lost_matches": 0}
+        self.last_run_ms = 0.0
+
+    def ensure_started(self):
+        if not self.started:
+            self.started = True
+            socketio.start_background_task(self.run)
+
+    def run(self):
+        interval = float(app.config.get("REAPER_INTERVAL", 30))
+        while True:
+            socketio.sleep(interval)
+            # при общем хранилище убирает один воркер
+            if not LIVE_STORE.lease("reaper", 2 * interval):
+                continue
+            with app.app_context():
+                try:
+                    self.reap(time.time())
+                except Exception:
+                    app.logger.exception("live reaper failed")
+                finally:
+                    db.session.remove()
+
+    def reap(self, now: float):
+        started = time.perf_counter()
+        self.reap_trainings(now)
+        self.reap_matches(now)
+        self.reap_queue(now)
+        self.reap_lost_matches(now)
+        self.runs += 1
+        self.last_run_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def reap_trainings(self, now: float):
+        ttl = int(app.config.get("TRAINING_IDLE_TTL", 1800))
+        for user_id, state in list(LIVE_TRAININGS.items()):
+            if now - (state.touched_at or now) < ttl:
+                continue
+            if LIVE_TRAININGS.pop(user_id, None) is None:
+                continue
+            disarm_training_timer(user_id)
+            self.evicted["trainings"] += 1
+
+    def reap_matches(self, now: float):
+        ttl = int(app.config.get("PENDING_MATCH_TTL", 300))
+        expired = []
+        for match_id, state in list(LIVE_MATCHES.items()):
+            if state.running or now - (state.created_at or now) < ttl:
+                continue
+            with LIVE_MATCHES.locked(match_id):
+                state = LIVE_MATCHES.get(match_id)
+                if not state or state.running:
+                    continue
+                token = f"match:{match_id}:finish"
+                if LIVE_STORE.claimed(token):
+                    # матч уже завершён — просто хвост живого состояния: без БД и тоста
+                    LIVE_MATCHES.pop(match_id, None)
+                    self.evicted["matches"] += 1
+                    continue
+                # как finish_match: повторный match:join матч уже не запустит
+                if not LIVE_STORE.claim(token):
+                    continue
+                LIVE_MATCHES.pop(match_id, None)
+            disarm_match_timer(match_id)
+            expired.append(match_id)
+        if not expired:
+            return
+
+        # тост — только тем матчам, что и правда не начались (в БД ещё pending)
+        abandoned = run_db(db_abandon_matches, expired)
+        self.evicted["matches"] += len(expired)
+        for match_id in abandoned:
+            socketio.emit(
+                "toast",
+                {"type": "secondary", "text": "Матч отменён: соперник так и не подключился."},
+                to=match_room(match_id),
+            )
+
+    def reap_lost_matches(self, now: float):
+        MATCH_RESULTS.recover(now)
+        keep = {match_id for match_id, _ in LIVE_MATCHES.items()}
+        keep |= MATCH_RESULTS.pending_ids | MATCH_RESULTS.durable_ids()
+        grace = int(app.config.get("LOST_MATCH_GRACE", 300))
+        self.evicted["lost_matches"] += len(run_db(db_interrupt_lost_matches, grace, keep))
+
+    def reap_queue(self, now: float):
+        ttl = int(app.config.get("QUEUE_TTL", 900))
+        manager = socketio.server.manager
+        for e in list(WAITING):
+            # sid другого воркера локальный manager не знает — там только TTL
+            dead = not LIVE_STORE.shared and not manager.is_connected(e.sid, "/")
+            if not dead and now - e.joined_at < ttl:
+                continue
+            if WAITING.remove_user(e.user_id) is None:
+                continue
+            self.evicted["queue"] += 1
+            if not dead:
+                socketio.emit("queue:status", {"status": "idle"}, to=e.sid)
+
+    def stats(self) -> Dict:
+        return {"runs": self.runs, "last_run_ms": self.last_run_ms, "evicted": dict(self.evicted)}
+
+
+REAPER = LiveReaper()
 
 
 # ----------------------------
@@ -276,6 +2593,10 @@ def training_options() -> Dict:
 def ensure_db():
     with app.app_context():
         db.create_all()
+        # create_all не трогает существующие таблицы — индексы добавляем отдельно
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
 
 
 # ----------------------------
@@ -343,13 +2664,20 @@ def register():
     if exists:
         return render_template("register.html", error="Такой логин уже занят.")
 
+    try:
+        password_hash = PASSWORDS.hash(password)
+    except HasherBusy:
+        return render_template("register.html", error=HASHER_BUSY_TEXT), 503
+
     user = AuthUser(
         username=username,
-        password_hash=generate_password_hash(password),
+        password_hash=password_hash,
         rating=1000,
     )
     db.session.add(user)
     db.session.commit()
+    if RATINGS.loaded:
+        RATINGS.set(user.id, user.username, user.rating)
 
     session["user_id"] = user.id
     session["username"] = user.username
@@ -365,12 +2693,18 @@ def login():
     password = request.form.get("password") or ""
 
     user = AuthUser.query.filter_by(username=username).first()
-    if not user or not check_password_hash(user.password_hash, password):
+    try:
+        ok = bool(user) and PASSWORDS.verify(user.password_hash, password)
+        # старые параметры хэша — тихо пересчитываем, пока пароль под рукой
+        if ok and PASSWORDS.needs_rehash(user.password_hash):
+            user.password_hash = PASSWORDS.hash(password)
+    except HasherBusy:
+        return render_template("login.html", error=HASHER_BUSY_TEXT), 503
+    if not ok:
         return render_template("login.html", error="Неверный логин или пароль.")
 
-    if hasattr(user, "last_login_at"):
-        user.last_login_at = datetime.utcnow()
-        db.session.commit()
+    user.last_login_at = datetime.utcnow()
+    db.session.commit()
 
     session["user_id"] = user.id
     session["username"] = user.username
@@ -383,44 +2717,155 @@ def logout():
     return redirect(url_for("login"))
 
 
-# ----------------------------
-# Admin routes
-# ----------------------------
-@app.route("/admin")
-@admin_required
-def admin_index():
-    return render_template("admin/index.html")
+# ----------------------------
+# Admin routes
+# ----------------------------
+@app.route("/admin")
+@admin_required
+def admin_index():
+    return render_template("admin/index.html")
+
+
+@app.route("/admin/metrics.json")
+@admin_required
+def admin_metrics():
+    return {
+        "timers": TIMERS.stats(),
+        "match_results": MATCH_RESULTS.stats(),
+        "db_executor": DB_EXECUTOR.stats(),
+        "passwords": PASSWORDS.stats(),
+        "user_cache": USER_CACHE.stats(),
+        "live_store": LIVE_STORE.stats(),
+        "live_sessions": live_memory_stats(),
+        "reaper": REAPER.stats(),
+    }
+
+
+ADMIN_PAGE_SIZE = 50
+
+
+def like_prefix(val: str) -> str:
+    return val.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
 
 
 @app.route("/admin/users")
 @admin_required
 def admin_users():
-    users = AuthUser.query.order_by(AuthUser.rating.desc()).all()
-    stats = {}
-
-    for u in users:
-        ended = (
-            Match.query.filter(Match.status == "ended")
-            .filter((Match.player1_id == u.id) | (Match.player2_id == u.id))
-            .count()
-        )
-        wins = Match.query.filter(Match.status == "ended", Match.winner_user_id == u.id).count()
-        draws = (
-            Match.query.filter(Match.status == "ended", Match.winner_user_id.is_(None))
-            .filter((Match.player1_id == u.id) | (Match.player2_id == u.id))
-            .count()
+    """
+    Одна страница пользователей одним запросом: keyset по (rating desc, id),
+    счётчики матчей — из user_stats.
+    """
+    q = (request.args.get("q") or "").strip()
+    after_rating = request.args.get("after_rating", type=int)
+    after_id = request.args.get("after_id", type=int)
+
+    query = read_db().query(
+        AuthUser.id,
+        AuthUser.username,
+        AuthUser.rating,
+        AuthUser.is_admin,
+        UserStats.ended,
+        UserStats.wins,
+        UserStats.losses,
+        UserStats.draws,
+    ).outerjoin(UserStats, UserStats.user_id == AuthUser.id)
+
+    if q:
+        query = query.filter(AuthUser.username.like(like_prefix(q), escape="\\"))
+    if after_rating is not None and after_id is not None:
+        query = query.filter(
+            (AuthUser.rating < after_rating) | ((AuthUser.rating == after_rating) & (AuthUser.id > after_id))
         )
-        losses = max(0, ended - wins - draws)
-        stats[u.id] = {"ended": ended, "wins": wins, "losses": losses, "draws": draws}
 
-    return render_template("admin/users_list.html", users=users, stats=stats)
+    rows = query.order_by(AuthUser.rating.desc(), AuthUser.id.asc()).limit(ADMIN_PAGE_SIZE + 1).all()
+    has_next = len(rows) > ADMIN_PAGE_SIZE
+    users = rows[:ADMIN_PAGE_SIZE]
+
+    stats = {
+        u.id: {"ended": u.ended or 0, "wins": u.wins or 0, "losses": u.losses or 0, "draws": u.draws or 0}
+        for u in users
+    }
+    next_args = None
+    if has_next:
+        last = users[-1]
+        next_args = {"q": q or None, "after_rating": last.rating, "after_id": last.id}
+
+    return render_template(
+        "admin/users_list.html",
+        users=users,
+        stats=stats,
+        q=q,
+        next_args=next_args,
+        is_first_page=after_id is None,
+    )
+
+
+TASK_PROMPT_PREVIEW = 120
 
 
 @app.route("/admin/tasks")
 @admin_required
 def admin_tasks():
-    tasks = Task.query.order_by(Task.id.desc()).all()
-    return render_template("admin/tasks_list.html", tasks=tasks)
+    """
+    Страница задач: только нужные колонки + обрезанный prompt,
+    keyset по id (before_id), фильтры на стороне БД.
+    """
+    subject = (request.args.get("subject") or "").strip()
+    topic = (request.args.get("topic") or "").strip()
+    difficulty = (request.args.get("difficulty") or "").strip()
+    active = (request.args.get("active") or "").strip()  # "", "1", "0"
+    before_id = request.args.get("before_id", type=int)
+
+    filters = []
+    if subject:
+        filters.append(Task.subject == subject)
+    if topic:
+        filters.append(Task.topic == topic)
+    if difficulty:
+        filters.append(Task.difficulty == difficulty)
+    if active in ("1", "0"):
+        filters.append(Task.is_active.is_(active == "1"))
+
+    query = read_db().query(
+        Task.id,
+        Task.subject,
+        Task.topic,
+        Task.difficulty,
+        Task.is_active,
+        func.substr(Task.prompt, 1, TASK_PROMPT_PREVIEW).label("prompt_short"),
+        (func.length(Task.prompt) > TASK_PROMPT_PREVIEW).label("prompt_cut"),
+    ).filter(*filters)
+    if before_id is not None:
+        query = query.filter(Task.id < before_id)
+
+    rows = query.order_by(Task.id.desc()).limit(ADMIN_PAGE_SIZE + 1).all()
+    has_next = len(rows) > ADMIN_PAGE_SIZE
+    tasks = rows[:ADMIN_PAGE_SIZE]
+
+    # активные считаем по индексу в памяти, остальное — COUNT в БД
+    if active == "1":
+        total = TASK_INDEX.count(subject or None, topic or None, difficulty or None)
+    else:
+        total = read_db().query(func.count(Task.id)).filter(*filters).scalar()
+
+    filter_args = {
+        "subject": subject or None,
+        "topic": topic or None,
+        "difficulty": difficulty or None,
+        "active": active or None,
+    }
+    next_args = dict(filter_args, before_id=tasks[-1].id) if has_next else None
+
+    return render_template(
+        "admin/tasks_list.html",
+        tasks=tasks,
+        total=total,
+        options=training_options(),
+        filters={"subject": subject, "topic": topic, "difficulty": difficulty, "active": active},
+        filter_args=filter_args,
+        next_args=next_args,
+        is_first_page=before_id is None,
+    )
 
 
 @app.route("/admin/tasks/new", methods=["GET", "POST"])
@@ -451,6 +2896,7 @@ def admin_task_new():
     )
     db.session.add(t)
     db.session.commit()
+    TASK_INDEX.upsert(t)
     return redirect(url_for("admin_tasks"))
 
 
@@ -476,6 +2922,7 @@ def admin_task_edit(task_id: int):
         return render_template("admin/task_form.html", task=t, error="Заполни prompt / answer")
 
     db.session.commit()
+    TASK_INDEX.upsert(t)
     return redirect(url_for("admin_tasks"))
 
 
@@ -487,6 +2934,7 @@ def admin_task_toggle(task_id: int):
         abort(404)
     t.is_active = not t.is_active
     db.session.commit()
+    TASK_INDEX.upsert(t)
     return redirect(url_for("admin_tasks"))
 
 
@@ -498,166 +2946,286 @@ def admin_task_delete(task_id: int):
         abort(404)
     db.session.delete(t)
     db.session.commit()
+    TASK_INDEX.discard(task_id)
     return redirect(url_for("admin_tasks"))
 
 
-@app.route("/admin/tasks/export.json")
-@admin_required
-def admin_tasks_export_json():
-    tasks = Task.query.order_by(Task.id.asc()).all()
-    data = []
-    for t in tasks:
-        data.append(
-            {
-                "id": t.id,
-                "subject": getattr(t, "subject", DEFAULT_SUBJECT),
-                "topic": t.topic,
-                "prompt": t.prompt,
-                "answer": t.answer,
-                "kind": t.kind,
-                "difficulty": t.difficulty,
-                "is_active": t.is_active,
-            }
+# ----------------------------
+# Admin: потоковый экспорт задач
+# ----------------------------
+EXPORT_FIELDS = ["id", "subject", "topic", "prompt", "answer", "kind", "difficulty", "is_active"]
+EXPORT_BATCH = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def iter_export_tasks():
+    """
+    Задачи по id батчами (yield_per) — в памяти не больше EXPORT_BATCH строк.
+    """
+    q = (
+        read_db().query(
+            Task.id, Task.subject, Task.topic, Task.prompt, Task.answer, Task.kind, Task.difficulty, Task.is_active
         )
-    return Response(
-        json.dumps(data, ensure_ascii=False, indent=2),
-        mimetype="application/json",
-        headers={"Content-Disposition": "attachment; filename=tasks.json"},
+        .order_by(Task.id.asc())
+        .execution_options(yield_per=EXPORT_BATCH)
     )
+    for r in q:
+        yield {
+            "id": r.id,
+            "subject": r.subject,
+            "topic": r.topic,
+            "prompt": r.prompt,
+            "answer": r.answer,
+            "kind": r.kind,
+            "difficulty": r.difficulty,
+            "is_active": r.is_active,
+        }
 
 
-@app.route("/admin/tasks/export.csv")
-@admin_required
-def admin_tasks_export_csv():
-    out = io.StringIO()
-    w = csv.writer(out)
-    w.writerow(["id", "subject", "topic", "prompt", "answer", "kind", "difficulty", "is_active"])
-    for t in Task.query.order_by(Task.id.asc()).all():
-        w.writerow(
-            [
-                t.id,
-                getattr(t, "subject", DEFAULT_SUBJECT),
-                t.topic,
-                t.prompt,
-                t.answer,
-                t.kind,
-                t.difficulty,
-                int(t.is_active),
-            ]
-        )
+def iter_export_json():
+    # тот же вид, что json.dumps(list, indent=2), но по одной задаче
+    first = True
+    for item in iter_export_tasks():
+        body = json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        yield ("[\n  " if first else ",\n  ") + body
+        first = False
+    yield "[]" if first else "\n]"
+
+
+def iter_export_jsonl():
+    for item in iter_export_tasks():
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+
+class _CsvLine:
+    def write(self, value):
+        return value
 
+
+def iter_export_csv():
+    w = csv.writer(_CsvLine())
+    yield w.writerow(EXPORT_FIELDS)
+    for item in iter_export_tasks():
+        item["is_active"] = int(item["is_active"])
+        yield w.writerow([item[k] for k in EXPORT_FIELDS])
+
+
+def iter_chunks(parts, gzip: bool):
+    """
+    Склеиваем мелкие куски в ~64 КБ и, если нужно, жмём gzip на лету.
+    """
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buf = []
+    size = 0
+    for part in parts:
+        data = part.encode("utf-8")
+        buf.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(buf)
+            buf, size = [], 0
+            chunk = z.compress(chunk) if z else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(buf)
+    if z:
+        chunk = z.compress(chunk) + z.flush()
+    if chunk:
+        yield chunk
+
+
+def export_response(parts, filename: str, mimetype: str) -> Response:
+    gzip = request.args.get("gzip") in ("1", "true", "yes")
+    if gzip:
+        filename += ".gz"
+        mimetype = "application/gzip"
     return Response(
-        out.getvalue(),
-        mimetype="text/csv; charset=utf-8",
-        headers={"Content-Disposition": "attachment; filename=tasks.csv"},
+        stream_with_context(iter_chunks(parts, gzip)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
     )
 
 
-@app.route("/admin/tasks/import", methods=["GET", "POST"])
+@app.route("/admin/tasks/export.json")
 @admin_required
-def admin_tasks_import():
-    if request.method == "GET":
-        return render_template("admin/tasks_import.html", error=None)
+def admin_tasks_export_json():
+    return export_response(iter_export_json(), "tasks.json", "application/json")
 
-    f = request.files.get("file")
-    if not f or not f.filename:
-        return render_template("admin/tasks_import.html", error="Выбери файл")
 
-    name = f.filename.lower()
-    raw = f.read()
+@app.route("/admin/tasks/export.jsonl")
+@admin_required
+def admin_tasks_export_jsonl():
+    return export_response(iter_export_jsonl(), "tasks.jsonl", "application/x-ndjson")
 
-    created = 0
-    updated = 0
 
-    if name.endswith(".json"):
-        items = json.loads(raw.decode("utf-8"))
-        if not isinstance(items, list):
-            return render_template("admin/tasks_import.html", error="JSON должен быть массивом объектов.")
+@app.route("/admin/tasks/export.csv")
+@admin_required
+def admin_tasks_export_csv():
+    return export_response(iter_export_csv(), "tasks.csv", "text/csv; charset=utf-8")
 
-        for it in items:
-            if not isinstance(it, dict):
-                continue
 
-            t_id = it.get("id")
-            subject = normalize_subject(it.get("subject") or DEFAULT_SUBJECT)
-            topic = normalize_topic(it.get("topic") or DEFAULT_TOPIC)
-            prompt = (it.get("prompt") or "").strip()
-            answer = (it.get("answer") or "").strip()
-            kind = (it.get("kind") or "text").strip()
-            difficulty = normalize_difficulty(it.get("difficulty") or DEFAULT_DIFFICULTY)
-            is_active = bool(it.get("is_active", True))
+# ----------------------------
+# Admin: пакетный импорт задач
+# ----------------------------
+IMPORT_CHUNK = 1000
+TASK_CONTENT_FIELDS = ("subject", "topic", "prompt", "answer", "kind", "difficulty", "is_active")
 
-            if not prompt or not answer:
-                continue
 
-            t = db.session.get(Task, int(t_id)) if t_id else None
-            if t:
-                t.subject = subject
-                t.topic = topic
-                t.prompt = prompt
-                t.answer = answer
-                t.kind = kind
-                t.difficulty = difficulty
-                t.is_active = is_active
-                updated += 1
-            else:
-                db.session.add(
-                    Task(
-                        subject=subject,
-                        topic=topic,
-                        prompt=prompt,
-                        answer=answer,
-                        kind=kind,
-                        difficulty=difficulty,
-                        is_active=is_active,
-                    )
-                )
-                created += 1
-
-    elif name.endswith(".csv"):
-        text = raw.decode("utf-8")
-        reader = csv.DictReader(io.StringIO(text))
-        for row in reader:
-            t_id = (row.get("id") or "").strip()
-            subject = normalize_subject(row.get("subject") or DEFAULT_SUBJECT)
-            topic = normalize_topic(row.get("topic") or DEFAULT_TOPIC)
-            prompt = (row.get("prompt") or "").strip()
-            answer = (row.get("answer") or "").strip()
-            kind = (row.get("kind") or "text").strip()
-            difficulty = normalize_difficulty(row.get("difficulty") or DEFAULT_DIFFICULTY)
-            is_active = (row.get("is_active") or "1").strip() in ("1", "true", "True", "yes", "YES")
-
-            if not prompt or not answer:
-                continue
+def task_content_hash(row) -> str:
+    h = hashlib.sha1()
+    for k in TASK_CONTENT_FIELDS:
+        v = row[k] if isinstance(row, dict) else getattr(row, k)
+        h.update(str(v).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
 
-            t = db.session.get(Task, int(t_id)) if t_id.isdigit() else None
-            if t:
-                t.subject = subject
-                t.topic = topic
-                t.prompt = prompt
-                t.answer = answer
-                t.kind = kind
-                t.difficulty = difficulty
-                t.is_active = is_active
-                updated += 1
-            else:
-                db.session.add(
-                    Task(
-                        subject=subject,
-                        topic=topic,
-                        prompt=prompt,
-                        answer=answer,
-                        kind=kind,
-                        difficulty=difficulty,
-                        is_active=is_active,
-                    )
-                )
-                created += 1
+
+def normalize_import_row(it, from_csv: bool) -> Optional[Dict]:
+    """
+    Строка файла -> поля задачи. None — строка невалидна.
+    """
+    if not isinstance(it, dict):
+        return None
+
+    t_id = str(it.get("id") or "").strip()
+    if from_csv:
+        is_active = (it.get("is_active") or "1").strip() in ("1", "true", "True", "yes", "YES")
+    else:
+        is_active = bool(it.get("is_active", True))
+
+    row = {
+        "id": int(t_id) if t_id.isdigit() else None,
+        "subject": normalize_subject(it.get("subject") or DEFAULT_SUBJECT),
+        "topic": normalize_topic(it.get("topic") or DEFAULT_TOPIC),
+        "prompt": str(it.get("prompt") or "").strip(),
+        "answer": str(it.get("answer") or "").strip(),
+        "kind": str(it.get("kind") or "text").strip(),
+        "difficulty": normalize_difficulty(str(it.get("difficulty") or DEFAULT_DIFFICULTY)),
+        "is_active": is_active,
+    }
+    if not row["prompt"] or not row["answer"]:
+        return None
+    return row
+
+
+def iter_import_rows(f, name: str):
+    """
+    Читаем загрузку потоком: CSV и JSON Lines построчно.
+    JSON-массив парсится целиком (для больших банков — .jsonl).
+    """
+    stream = io.TextIOWrapper(f.stream, encoding="utf-8-sig", newline="")
+    if name.endswith(".csv"):
+        for row in csv.DictReader(stream):
+            yield normalize_import_row(row, from_csv=True)
+    elif name.endswith(".jsonl"):
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                it = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield normalize_import_row(it, from_csv=False)
     else:
-        return render_template("admin/tasks_import.html", error="Нужен .csv или .json")
+        items = json.load(stream)
+        if not isinstance(items, list):
+            raise ValueError("JSON должен быть массивом объектов.")
+        for it in items:
+            yield normalize_import_row(it, from_csv=False)
 
+
+def import_task_chunk(rows: List[Dict], report: Dict):
+    """
+    Один чанк = одна транзакция: один SELECT ... IN по id, bulk insert, bulk update.
+    Строки, содержимое которых не изменилось, пропускаем.
+    """
+    ids = {r["id"] for r in rows if r["id"] is not None}
+    existing = {}
+    if ids:
+        q = db.session.query(
+            Task.id, Task.subject, Task.topic, Task.prompt, Task.answer, Task.kind, Task.difficulty, Task.is_active
+        ).filter(Task.id.in_(ids))
+        existing = {r.id: task_content_hash(r) for r in q}
+
+    now = datetime.utcnow()
+    to_insert = []
+    to_update = []
+    for r in rows:
+        old_hash = existing.get(r["id"])
+        if old_hash is None:
+            new = dict(r)
+            new.pop("id")
+            to_insert.append(new)
+        elif old_hash == task_content_hash(r):
+            report["skipped"] += 1
+        else:
+            to_update.append(dict(r, updated_at=now))
+
+    if to_insert:
+        db.session.execute(insert(Task), to_insert)
+    if to_update:
+        db.session.execute(update(Task), to_update)
     db.session.commit()
-    return redirect(url_for("admin_tasks"))
+
+    report["created"] += len(to_insert)
+    report["updated"] += len(to_update)
+
+
+def import_tasks(rows) -> Dict:
+    report = {"created": 0, "updated": 0, "skipped": 0, "invalid": 0, "seconds": 0.0}
+    started = time.perf_counter()
+
+    chunk = []
+    for r in rows:
+        if r is None:
+            report["invalid"] += 1
+            continue
+        chunk.append(r)
+        if len(chunk) >= IMPORT_CHUNK:
+            import_task_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        import_task_chunk(chunk, report)
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+@app.route("/admin/tasks/import", methods=["GET", "POST"])
+@admin_required
+def admin_tasks_import():
+    if request.method == "GET":
+        return render_template("admin/tasks_import.html", error=None, report=None)
+
+    f = request.files.get("file")
+    if not f or not f.filename:
+        return render_template("admin/tasks_import.html", error="Выбери файл", report=None)
+
+    name = f.filename.lower()
+    if not name.endswith((".csv", ".json", ".jsonl")):
+        return render_template("admin/tasks_import.html", error="Нужен .csv, .json или .jsonl", report=None)
+
+    error, report = None, None
+    try:
+        report = import_tasks(iter_import_rows(f, name))
+    except (ValueError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        error = f"Ошибка чтения файла: {e}"
+    finally:
+        # часть чанков могла уже закоммититься — индекс устарел в любом случае
+        TASK_INDEX.invalidate()
+
+    # перечитываем сразу здесь (выборка в run_db), а не в первом pick_task на сокетах;
+    # сбой не должен подменить ошибку/отчёт импорта — индекс останется stale
+    # и перечитается при следующем ensure_loaded
+    try:
+        TASK_INDEX.load()
+    except Exception:
+        app.logger.exception("task index reload after import failed")
+
+    return render_template("admin/tasks_import.html", error=error, report=report)
 
 
 @app.route("/admin/users/<int:user_id>/delete", methods=["POST"])
@@ -671,13 +3239,16 @@ def admin_user_delete(user_id: int):
     if user.id == session.get("user_id"):
         abort(400, "Нельзя удалить самого себя")
 
-    # Удаляем связанные матчи
+    # Удаляем связанные матчи (и вычитаем их из статистики соперников)
+    forget_user_matches(user.id)
     Match.query.filter((Match.player1_id == user.id) | (Match.player2_id == user.id)).delete(
         synchronize_session=False
     )
 
     db.session.delete(user)
     db.session.commit()
+    USER_CACHE.invalidate(user_id)
+    RATINGS.remove(user_id)
 
     return redirect(url_for("admin_users"))
 
@@ -694,61 +3265,120 @@ def on_queue_join(_data):
 
     remove_from_queue_by_user(uid)
 
-    user = db.session.get(AuthUser, uid)
+    # итог прошлого матча ещё не записан — до записи в БД и кэше старый рейтинг
+    wait = max(2.0, 10 * float(app.config.get("RESULTS_FLUSH_INTERVAL", 0.2)))
+    if not MATCH_RESULTS.wait_user(uid, wait):
+        app.logger.warning("queue:join: match result of user %s still not written", uid)
+
+    user = USER_CACHE.get(uid)
     if not user:
         emit("toast", {"type": "danger", "text": "Пользователь не найден."})
         return
 
     entry = QueueEntry(
         user_id=uid,
-        username=user.username,
-        rating=int(user.rating),
+        username=user["username"],
+        rating=user["rating"],
         sid=request.sid,
         joined_at=time.time(),
     )
 
-    opponent = find_best_opponent(entry)
-    if opponent:
-        remove_from_queue_by_user(opponent.user_id)
-
-        m = Match(
-            player1_id=entry.user_id,
-            player2_id=opponent.user_id,
-            player1_name=entry.username,
-            player2_name=opponent.username,
-            player1_rating=entry.rating,
-            player2_rating=opponent.rating,
-            duration_sec=int(app.config.get("DEFAULT_MATCH_SECONDS", 600)),
-            status="pending",
+    # пару подберёт фоновый matchmaking_loop
+    WAITING.add(entry)
+    ensure_matchmaker()
+    REAPER.ensure_started()
+    emit("queue:status", {"status": "searching", "rating": entry.rating})
+
+
+_MATCHMAKER = {"started": False}
+
+
+def ensure_matchmaker():
+    if _MATCHMAKER["started"]:
+        return
+    _MATCHMAKER["started"] = True
+    socketio.start_background_task(matchmaking_loop)
+
+
+def matchmaking_loop():
+    interval = float(app.config.get("MATCHMAKING_INTERVAL", 1.0))
+    while True:
+        socketio.sleep(interval)
+        if len(WAITING) < 2:
+            continue
+        # при общем хранилище пары подбирает один воркер
+        if not LIVE_STORE.lease("matchmaker", 5 * interval):
+            continue
+        with app.app_context():
+            try:
+                matchmaking_tick()
+            except Exception:
+                app.logger.exception("matchmaking tick failed")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def matchmaking_tick():
+    """
+    Один проход подбора: все пары тика создаются одной транзакцией.
+    """
+    pairs = plan_pairs(list(WAITING), time.time())
+    if not pairs:
+        return
+
+    duration = int(app.config.get("DEFAULT_MATCH_SECONDS", 600))
+    ordered = []
+    rows = []
+    for a, b in pairs:
+        # забираем обоих из очереди до создания матча: кто уже вышел
+        # (или попал в пару в другом воркере), тот в матч не попадёт
+        taken = [e for e in (a, b) if WAITING.remove_user(e.user_id) is not None]
+        if len(taken) < 2:
+            for e in taken:
+                WAITING.add(e)
+            continue
+        # первым игроком считаем того, кто дольше ждал
+        if b.joined_at < a.joined_at:
+            a, b = b, a
+        ordered.append((a, b))
+        rows.append(
+            {
+                "player1_id": a.user_id,
+                "player2_id": b.user_id,
+                "player1_name": a.username,
+                "player2_name": b.username,
+                "player1_rating": a.rating,
+                "player2_rating": b.rating,
+                "duration_sec": duration,
+                "status": "pending",
+            }
         )
-        db.session.add(m)
-        db.session.commit()
+    if not rows:
+        return
+    try:
+        match_ids = run_db(db_create_matches, rows)
+    except Exception:
+        # матчи не создались — возвращаем игроков в очередь
+        for a, b in ordered:
+            WAITING.add(a)
+            WAITING.add(b)
+        raise
 
-        LIVE_MATCHES[m.id] = {
-            "p1_sid": None,
-            "p2_sid": None,
-            "p1_id": m.player1_id,
-            "p2_id": m.player2_id,
-            "seconds_left": m.duration_sec,
-            "running": False,
-            "task": pick_task(),  # сервер-only хранит answer
-            "submissions": {},
-        }
+    for match_id, (a, b) in zip(match_ids, ordered):
+        # task — сервер-only, хранит answer
+        LIVE_MATCHES[match_id] = LiveMatch(a.user_id, b.user_id, a.username, b.username, duration, pick_task())
 
-        emit(
+        socketio.emit(
             "match:found",
-            {"match_id": m.id, "opponent_name": opponent.username, "opponent_rating": opponent.rating},
-            to=entry.sid,
+            {"match_id": match_id, "opponent_name": b.username, "opponent_rating": b.rating},
+            to=a.sid,
         )
-        emit(
+        socketio.emit(
             "match:found",
-            {"match_id": m.id, "opponent_name": entry.username, "opponent_rating": entry.rating},
-            to=opponent.sid,
+            {"match_id": match_id, "opponent_name": a.username, "opponent_rating": a.rating},
+            to=b.sid,
         )
-        return
-
-    WAITING.append(entry)
-    emit("queue:status", {"status": "searching", "rating": entry.rating})
 
 
 @socketio.on("queue:leave")
@@ -763,7 +3393,7 @@ def on_queue_leave(_data):
 # Socket.IO: training
 # ----------------------------
 @socketio.on("training:join")
-def on_training_join(_data=None):
+def on_training_join(data=None):
     uid, uname = ensure_user()
     if not uid:
         emit("toast", {"type": "danger", "text": "Нужно войти."})
@@ -776,58 +3406,50 @@ def on_training_join(_data=None):
 
     state = LIVE_TRAININGS.get(uid)
     if not state:
-        # дефолтные фильтры
-        filters = {"subject": "Любой", "topic": "Любая", "difficulty": "Любая"}
-
-        task = pick_task_filtered(filters["subject"], filters["topic"], filters["difficulty"])
-        state = {
-            "user_id": uid,
-            "username": uname,
-            "room": room,
-            "sid": request.sid,
-            "running": True,
-            "seconds_left": secs,
-            "task": task,
-            "stats": {"total": 0, "solved": 0},
-            "filters": filters,
-            "generation": 0,  # защита от дубля таймеров
-        }
+        state = LiveTraining(uid, uname, room, request.sid, secs)
+        training_reset_deck(state)
+        state.task = training_draw_task(state)
         LIVE_TRAININGS[uid] = state
     else:
-        state["sid"] = request.sid
-        state["room"] = room
-        state["running"] = True
-        if not state.get("filters"):
-            state["filters"] = {"subject": "Любой", "topic": "Любая", "difficulty": "Любая"}
-        if not state.get("task"):
-            f = state["filters"]
-            state["task"] = pick_task_filtered(f["subject"], f["topic"], f["difficulty"])
-        if not state.get("seconds_left"):
-            state["seconds_left"] = secs
-
-    # options для селектов
-    emit("training:options", training_options(), to=room)
+        state.sid = request.sid
+        state.room = room
+        state.touched_at = time.time()
+        if not state.task:
+            state.task = training_draw_task(state)
+        if not state.running:
+            # после training:leave продолжаем с того же остатка времени
+            state.seconds_left = state.seconds_left or secs
+            state.deadline = None
+        state.running = True
+
+    if not state.deadline:
+        state.deadline = time.time() + state.seconds_left
+
+    # options для селектов: не шлём повторно, если у клиента актуальная версия
+    options = training_options()
+    if (data or {}).get("options_version") != options["version"]:
+        emit("training:options", options, to=room)
 
     # отдадим текущую задачу
-    task = state["task"]
+    task = state.task
     emit(
         "training:task",
         {
-            "subject": task.get("subject", DEFAULT_SUBJECT),
-            "topic": task.get("topic", DEFAULT_TOPIC),
-            "difficulty": task.get("difficulty", DEFAULT_DIFFICULTY),
-            "prompt": task.get("prompt", ""),
-            "seconds_left": int(state["seconds_left"]),
-            "stats": state["stats"],
-            "filters": state["filters"],
+            "subject": task.subject or DEFAULT_SUBJECT,
+            "topic": task.topic or DEFAULT_TOPIC,
+            "difficulty": task.difficulty or DEFAULT_DIFFICULTY,
+            "prompt": task.prompt or "",
+            **clock_payload(state),
+            "stats": state.stats(),
+            "filters": state.filters(),
         },
         to=room,
     )
 
-    # старт/рестарт таймера (одно поколение на задачу)
-    state["generation"] += 1
-    gen = state["generation"]
-    socketio.start_background_task(training_timer_task, uid, gen)
+    # перевзвод таймера (одно поколение на задачу)
+    start_training_timer(state)
+    LIVE_TRAININGS.save(uid, state)
+    REAPER.ensure_started()
 
 
 @socketio.on("training:set_filters")
@@ -848,81 +3470,141 @@ def on_training_set_filters(data):
     if difficulty not in ("Любая",) + DIFFICULTIES:
         difficulty = "Любая"
 
-    state["filters"] = {"subject": subject, "topic": topic, "difficulty": difficulty}
+    state.subject, state.topic, state.difficulty = subject, topic, difficulty
+    state.touched_at = time.time()
+    training_reset_deck(state)
+    LIVE_TRAININGS.save(uid, state)
     training_next_task(uid)
 
 
-def training_timer_task(user_id: int, generation: int):
+def training_reset_deck(state: LiveTraining):
+    """
+    Новая колода под текущие фильтры (при смене фильтров и создании сессии).
+    """
+    state.deck = []
+    state.seen = set()
+    state.deck_refilling = False
+    training_refill_deck(state)
+
+
+def training_refill_deck(state: LiveTraining):
+    key = filters_key(state.subject, state.topic, state.difficulty)
+    seen = state.seen
+    in_deck = {t.id for t in state.deck}
+
+    fresh = TASK_INDEX.sample(*key, TRAINING_DECK_SIZE, exclude=seen | in_deck)
+    if not fresh and not state.deck and seen:
+        # прошли все задачи под фильтры — начинаем новый круг
+        seen.clear()
+        fresh = TASK_INDEX.sample(*key, TRAINING_DECK_SIZE)
+    state.deck.extend(fresh)
+
+
+def training_refill_task(user_id: int):
     with app.app_context():
-        while True:
-            state = LIVE_TRAININGS.get(user_id)
-            if not state:
-                return
-            if state.get("generation") != generation:
-                return
-            if not state.get("running"):
-                return
+        state = LIVE_TRAININGS.get(user_id)
+        if not state:
+            return
+        try:
+            if len(state.deck) < TRAINING_DECK_LOW:
+                training_refill_deck(state)
+        finally:
+            state.deck_refilling = False
+            LIVE_TRAININGS.save(user_id, state)
 
-            if state["seconds_left"] <= 0:
-                # таймаут
-                task = state["task"]
-                correct = task.get("answer", "")
-                socketio.emit(
-                    "training:result",
-                    {
-                        "correct": False,
-                        "reason": "timeout",
-                        "correct_answer": correct,
-                        "stats": state["stats"],
-                    },
-                    to=state["room"],
-                )
-                socketio.sleep(1)
-                training_next_task(user_id, generation)
-                return
 
-            socketio.sleep(1)
-            state["seconds_left"] -= 1
-            socketio.emit(
-                "training:tick",
-                {"seconds_left": int(state["seconds_left"])},
-                to=state["room"],
-            )
+def training_draw_task(state: LiveTraining) -> TaskRecord:
+    """
+    Следующая задача из колоды без обращения к БД.
+    """
+    task = None
+    while task is None:
+        if not state.deck:
+            training_refill_deck(state)
+            if not state.deck:
+                return no_tasks_payload(state.subject, state.topic, state.difficulty)
+        task = state.deck.pop()
+        # задачу могли выключить/удалить в админке после того, как она попала в колоду
+        if TASK_INDEX.loaded and TASK_INDEX.tasks.get(task.id) is not task:
+            task = None
+
+    state.seen.add(task.id)
+
+    if len(state.deck) < TRAINING_DECK_LOW and not state.deck_refilling:
+        if LIVE_STORE.shared:
+            # копия состояния из общего хранилища: фоновая дозаливка затёрла бы чужие изменения
+            training_refill_deck(state)
+        else:
+            state.deck_refilling = True
+            socketio.start_background_task(training_refill_task, state.user_id)
+
+    return task
+
+
+def start_training_timer(state: LiveTraining):
+    state.generation += 1
+    arm_training_timer(state.user_id, state.generation, state.deadline)
+
+
+def training_timeout(user_id: int, generation: int):
+    if TRAINING_TIMERS.get(user_id, (None, None))[0] == generation:
+        TRAINING_TIMERS.pop(user_id, None)
+    with app.app_context():
+        state = LIVE_TRAININGS.get(user_id)
+        if not state:
+            return
+        if state.generation != generation:
+            return
+        if not state.running:
+            return
+
+        correct = state.task.answer or ""
+        socketio.emit(
+            "training:result",
+            {
+                "correct": False,
+                "reason": "timeout",
+                "correct_answer": correct,
+                "stats": state.stats(),
+            },
+            to=state.room,
+        )
+        socketio.sleep(1)
+        training_next_task(user_id, generation)
 
 
 def training_next_task(user_id: int, generation: Optional[int] = None):
     state = LIVE_TRAININGS.get(user_id)
     if not state:
         return
-    if generation is not None and state.get("generation") != generation:
+    if generation is not None and state.generation != generation:
         return
 
     secs = training_seconds_default()
-    f = state.get("filters") or {"subject": "Любой", "topic": "Любая", "difficulty": "Любая"}
 
-    state["task"] = pick_task_filtered(f["subject"], f["topic"], f["difficulty"])
-    state["seconds_left"] = secs
-    state["running"] = True
+    state.task = training_draw_task(state)
+    state.seconds_left = secs
+    state.deadline = time.time() + secs
+    state.running = True
 
-    task = state["task"]
+    task = state.task
     socketio.emit(
         "training:task",
         {
-            "subject": task.get("subject", DEFAULT_SUBJECT),
-            "topic": task.get("topic", DEFAULT_TOPIC),
-            "difficulty": task.get("difficulty", DEFAULT_DIFFICULTY),
-            "prompt": task.get("prompt", ""),
-            "seconds_left": int(state["seconds_left"]),
-            "stats": state["stats"],
-            "filters": f,
+            "subject": task.subject or DEFAULT_SUBJECT,
+            "topic": task.topic or DEFAULT_TOPIC,
+            "difficulty": task.difficulty or DEFAULT_DIFFICULTY,
+            "prompt": task.prompt or "",
+            **clock_payload(state),
+            "stats": state.stats(),
+            "filters": state.filters(),
         },
-        to=state["room"],
+        to=state.room,
     )
 
     # рестарт таймера
-    state["generation"] += 1
-    gen = state["generation"]
-    socketio.start_background_task(training_timer_task, user_id, gen)
+    start_training_timer(state)
+    LIVE_TRAININGS.save(user_id, state)
 
 
 @socketio.on("training:submit_answer")
@@ -932,7 +3614,7 @@ def on_training_submit_answer(data):
         return
 
     state = LIVE_TRAININGS.get(uid)
-    if not state or not state.get("running"):
+    if not state or not state.running:
         return
 
     ans = ((data or {}).get("answer") or "").strip()
@@ -940,17 +3622,18 @@ def on_training_submit_answer(data):
         emit("toast", {"type": "warning", "text": "Введи ответ."})
         return
 
-    task = state["task"]
-    correct = task.get("answer", "")
+    correct = state.task.answer or ""
+    state.touched_at = time.time()
 
     # не считаем попытку, если демо/нет ответа
     if correct:
-        state["stats"]["total"] += 1
-        ok = is_correct(ans, correct)
+        state.total += 1
+        ok = state.task.check(ans)
         if ok:
-            state["stats"]["solved"] += 1
+            state.solved += 1
     else:
         ok = False
+    LIVE_TRAININGS.save(uid, state)
 
     socketio.emit(
         "training:result",
@@ -958,9 +3641,9 @@ def on_training_submit_answer(data):
             "correct": ok,
             "reason": "answer",
             "correct_answer": correct if correct else "—",
-            "stats": state["stats"],
+            "stats": state.stats(),
         },
-        to=state["room"],
+        to=state.room,
     )
 
     socketio.sleep(1)
@@ -973,8 +3656,12 @@ def on_training_leave(_data=None):
     if not uid:
         return
     state = LIVE_TRAININGS.get(uid)
-    if state:
-        state["running"] = False
+    if state and state.running:
+        state.seconds_left = remaining_seconds(state)
+        state.running = False
+        state.touched_at = time.time()
+        LIVE_TRAININGS.save(uid, state)
+        disarm_training_timer(uid)
     emit("toast", {"type": "secondary", "text": "Тренировка остановлена."})
 
 
@@ -993,43 +3680,56 @@ def on_match_join(data):
         emit("toast", {"type": "danger", "text": "Некорректный match_id."})
         return
 
-    m = db.session.get(Match, match_id)
+    m = run_db(db_load_match, match_id)
     if not m:
         emit("toast", {"type": "danger", "text": "Матч не найден."})
         return
-    if uid not in (m.player1_id, m.player2_id):
+    if uid not in (m["player1_id"], m["player2_id"]):
         emit("toast", {"type": "danger", "text": "Вы не участник этого матча."})
         return
 
     room = match_room(match_id)
     join_room(room)
+    REAPER.ensure_started()
 
-    state = LIVE_MATCHES.get(match_id)
-    if not state:
-        state = {
-            "p1_sid": None,
-            "p2_sid": None,
-            "p1_id": m.player1_id,
-            "p2_id": m.player2_id,
-            "seconds_left": m.duration_sec,
-            "running": False,
-            "task": pick_task(),
-            "submissions": {},
-        }
-        LIVE_MATCHES[match_id] = state
+    finished = (
+        m["status"] in ("ended", "abandoned")
+        or MATCH_RESULTS.is_pending(match_id)
+        or LIVE_STORE.claimed(f"match:{match_id}:finish")
+    )
 
-    if uid == state["p1_id"]:
-        state["p1_sid"] = request.sid
-    else:
-        state["p2_sid"] = request.sid
+    with LIVE_MATCHES.locked(match_id):
+        state = LIVE_MATCHES.get(match_id)
+        if not state and finished:
+            # матч уже завершён — живое состояние заново не заводим, его бы никто не убрал
+            emit("toast", {"type": "secondary", "text": "Матч уже завершён."})
+            return
+        if not state:
+            state = LIVE_MATCHES.setdefault(
+                match_id,
+                LiveMatch(
+                    m["player1_id"],
+                    m["player2_id"],
+                    m["player1_name"],
+                    m["player2_name"],
+                    m["duration_sec"],
+                    pick_task(),
+                ),
+            )
+
+        if uid == state.p1_id:
+            state.p1_sid = request.sid
+        else:
+            state.p2_sid = request.sid
+        LIVE_MATCHES.save(match_id, state)
 
-    task = state["task"]
+    task = state.task
     emit(
         "match:task",
         {
-            "topic": task.get("topic", DEFAULT_TOPIC),
-            "difficulty": task.get("difficulty", DEFAULT_DIFFICULTY),
-            "prompt": task["prompt"],
+            "topic": task.topic or DEFAULT_TOPIC,
+            "difficulty": task.difficulty or DEFAULT_DIFFICULTY,
+            "prompt": task.prompt,
         },
         to=room,
     )
@@ -1037,48 +3737,39 @@ def on_match_join(data):
     emit(
         "match:state",
         {
-            "running": state["running"],
-            "seconds_left": state["seconds_left"],
+            "running": state.running,
+            **clock_payload(state),
             "me": uname,
-            "p1": m.player1_name,
-            "p2": m.player2_name,
+            "p1": m["player1_name"],
+            "p2": m["player2_name"],
         },
         to=room,
     )
 
-    if state["p1_sid"] and state["p2_sid"] and not state["running"] and m.status != "ended":
+    if state.p1_sid and state.p2_sid and not state.running and not finished:
         start_match(match_id)
 
 
 def start_match(match_id: int):
-    m = db.session.get(Match, match_id)
-    state = LIVE_MATCHES.get(match_id)
-    if not m or not state:
-        return
-
-    state["running"] = True
-    m.status = "started"
-    if hasattr(m, "started_at"):
-        m.started_at = datetime.utcnow()
-    db.session.commit()
+    # сначала живое состояние: пока ждём БД, второй join не запустит матч повторно
+    with LIVE_MATCHES.locked(match_id):
+        state = LIVE_MATCHES.get(match_id)
+        if not state or state.running:
+            return
+        state.deadline = time.time() + state.seconds_left
+        state.running = True
+        LIVE_MATCHES.save(match_id, state)
+    run_db(db_mark_match_started, match_id)
 
-    socketio.emit("match:started", {"seconds_left": state["seconds_left"]}, to=match_room(match_id))
-    socketio.start_background_task(timer_task, match_id)
+    socketio.emit("match:started", clock_payload(state), to=match_room(match_id))
+    arm_match_timer(match_id, state.deadline)
 
 
-def timer_task(match_id: int):
+def match_timeout(match_id: int):
+    MATCH_TIMERS.pop(match_id, None)
     with app.app_context():
-        room = match_room(match_id)
         state = LIVE_MATCHES.get(match_id)
-        if not state:
-            return
-
-        while state["running"] and state["seconds_left"] > 0:
-            socketio.sleep(1)
-            state["seconds_left"] -= 1
-            socketio.emit("match:tick", {"seconds_left": state["seconds_left"]}, to=room)
-
-        if not state["running"]:
+        if not state or not state.running:
             return
 
         finish_match(match_id, reason="time")
@@ -1094,36 +3785,32 @@ def on_match_submit_answer(data):
     match_id = int((data or {}).get("match_id", 0))
     ans = ((data or {}).get("answer") or "").strip()
 
-    m = db.session.get(Match, match_id)
-    if not m or m.status == "ended":
-        return
-    if uid not in (m.player1_id, m.player2_id):
-        return
-
-    state = LIVE_MATCHES.get(match_id)
-    if not state or not state.get("running"):
-        return
+    # источник правды для идущего матча — LIVE_MATCHES: в БД не ходим
+    with LIVE_MATCHES.locked(match_id):
+        state = LIVE_MATCHES.get(match_id)
+        if not state or not state.running:
+            return
+        if uid not in (state.p1_id, state.p2_id):
+            return
 
-    now = time.time()
-    task = state["task"]
-    correct = task["answer"]
+        now = time.time()
 
-    sub = state["submissions"].get(uid)
-    if not sub:
-        sub = {"first_ts": now, "first_correct_ts": None}
-        state["submissions"][uid] = sub
+        sub = state.submissions.get(uid)
+        if not sub:
+            sub = Submission(first_ts=now)
+            state.submissions[uid] = sub
 
-    sub["answer"] = ans
-    sub["ts"] = now
+        sub.answer = ans
+        sub.ts = now
+        sub.correct = state.task.check(ans)
 
-    if sub["first_correct_ts"] is None and is_correct(ans, correct):
-        sub["first_correct_ts"] = now
+        if sub.first_correct_ts is None and sub.correct:
+            sub.first_correct_ts = now
+        LIVE_MATCHES.save(match_id, state)
 
     socketio.emit("match:submitted", {"user_id": uid}, to=match_room(match_id))
 
-    p1_id = state["p1_id"]
-    p2_id = state["p2_id"]
-    if p1_id in state["submissions"] and p2_id in state["submissions"]:
+    if state.p1_id in state.submissions and state.p2_id in state.submissions:
         finish_match(match_id, reason="both_submitted")
 
 
@@ -1134,103 +3821,91 @@ def on_match_surrender(data):
         return
     match_id = int((data or {}).get("match_id", 0))
 
-    m = db.session.get(Match, match_id)
-    if not m or m.status == "ended":
+    state = LIVE_MATCHES.get(match_id)
+    if not state or not state.running:
         return
-    if uid not in (m.player1_id, m.player2_id):
+    if uid not in (state.p1_id, state.p2_id):
         return
 
-    winner_id = m.player2_id if uid == m.player1_id else m.player1_id
+    winner_id = state.p2_id if uid == state.p1_id else state.p1_id
     finish_match(match_id, winner_user_id=winner_id, reason="surrender")
 
 
 def finish_match(match_id: int, winner_user_id: Optional[int] = None, reason: str = "time"):
-    m = db.session.get(Match, match_id)
-    state = LIVE_MATCHES.get(match_id)
-    if not m or not state:
-        return
-    if m.status == "ended":
-        return
-    if not state.get("running"):
-        return
-
-    state["running"] = False
+    """
+    Итог считаем по LIVE_MATCHES и сразу отдаём игрокам;
+    запись в БД (статус, Elo, user_stats) уходит в MATCH_RESULTS.
+    Завершает матч ровно один вызов (claim в LIVE_STORE), даже если таймер
+    и последний ответ сработали одновременно в разных воркерах.
+    """
+    with LIVE_MATCHES.locked(match_id):
+        state = LIVE_MATCHES.get(match_id)
+        if not state or not state.running:
+            return
+        if not LIVE_STORE.claim(f"match:{match_id}:finish"):
+            return
+        state.running = False
+        LIVE_MATCHES.pop(match_id, None)
+    disarm_match_timer(match_id)
 
-    if reason != "surrender":
-        task = state["task"]
-        correct = task["answer"]
+    p1_id, p2_id = state.p1_id, state.p2_id
 
-        sub1 = state["submissions"].get(m.player1_id)
-        sub2 = state["submissions"].get(m.player2_id)
+    task = state.task
+    correct = task.answer
+    sub1 = state.submissions.get(p1_id)
+    sub2 = state.submissions.get(p2_id)
 
-        p1_ok = is_correct(sub1["answer"], correct) if sub1 else False
-        p2_ok = is_correct(sub2["answer"], correct) if sub2 else False
+    # вердикты посчитаны при отправке ответа
+    p1_ok = sub1.correct if sub1 else False
+    p2_ok = sub2.correct if sub2 else False
 
+    if reason != "surrender":
         if p1_ok and not p2_ok:
-            winner_user_id = m.player1_id
+            winner_user_id = p1_id
         elif p2_ok and not p1_ok:
-            winner_user_id = m.player2_id
+            winner_user_id = p2_id
         elif p1_ok and p2_ok:
-            t1 = sub1.get("first_correct_ts") if sub1 else None
-            t2 = sub2.get("first_correct_ts") if sub2 else None
+            t1 = sub1.first_correct_ts if sub1 else None
+            t2 = sub2.first_correct_ts if sub2 else None
             if t1 is None or t2 is None:
                 winner_user_id = None
             elif t1 < t2:
-                winner_user_id = m.player1_id
+                winner_user_id = p1_id
             elif t2 < t1:
-                winner_user_id = m.player2_id
+                winner_user_id = p2_id
             else:
                 winner_user_id = None
         else:
             winner_user_id = None
 
-    m.status = "ended"
-    if hasattr(m, "ended_at"):
-        m.ended_at = datetime.utcnow()
-    if hasattr(m, "winner_user_id"):
-        m.winner_user_id = winner_user_id
-    if hasattr(m, "reason"):
-        m.reason = reason
-
-    p1 = db.session.get(AuthUser, m.player1_id)
-    p2 = db.session.get(AuthUser, m.player2_id)
-    if p1 and p2:
-        r1, r2 = int(p1.rating), int(p2.rating)
-        k = int(app.config.get("ELO_K", 32))
-
-        if winner_user_id == m.player1_id:
-            s1, s2 = 1.0, 0.0
-        elif winner_user_id == m.player2_id:
-            s1, s2 = 0.0, 1.0
-        else:
-            s1, s2 = 0.5, 0.5
-
-        p1.rating = elo_apply(r1, r2, s1, k)
-        p2.rating = elo_apply(r2, r1, s2, k)
-
-    db.session.commit()
-
-    task = state["task"]
-    correct = task["answer"]
-    sub1 = state["submissions"].get(m.player1_id)
-    sub2 = state["submissions"].get(m.player2_id)
-
     payload = {
         "winner_user_id": winner_user_id,
         "reason": reason,
-        "p1_id": m.player1_id,
-        "p2_id": m.player2_id,
-        "p1_name": m.player1_name,
-        "p2_name": m.player2_name,
+        "p1_id": p1_id,
+        "p2_id": p2_id,
+        "p1_name": state.p1_name,
+        "p2_name": state.p2_name,
         "correct_answer": correct,
-        "p1_answer": sub1["answer"] if sub1 else None,
-        "p2_answer": sub2["answer"] if sub2 else None,
-        "p1_correct": is_correct(sub1["answer"], correct) if sub1 else False,
-        "p2_correct": is_correct(sub2["answer"], correct) if sub2 else False,
+        "p1_answer": sub1.answer if sub1 else None,
+        "p2_answer": sub2.answer if sub2 else None,
+        "p1_correct": p1_ok,
+        "p2_correct": p2_ok,
     }
 
+    # рейтинги поменяются при записи итога (MATCH_RESULTS сбросит кэш после коммита);
+    # queue:join до этого ждёт записи
     socketio.emit("match:ended", payload, to=match_room(match_id))
-    LIVE_MATCHES.pop(match_id, None)
+
+    MATCH_RESULTS.submit(
+        {
+            "match_id": match_id,
+            "p1_id": p1_id,
+            "p2_id": p2_id,
+            "winner_user_id": winner_user_id,
+            "reason": reason,
+            "ended_at": datetime.utcnow(),
+        }
+    )
 
 
 @socketio.on("disconnect")
@@ -1242,42 +3917,46 @@ def on_disconnect():
 @login_required
 def user_stats():
     uid = session["user_id"]
-    user = db.session.get(AuthUser, uid)
+    user = read_db().get(AuthUser, uid)
     if not user:
         abort(404)
 
-    total = (
-        Match.query
-        .filter(Match.status == "ended")
-        .filter((Match.player1_id == uid) | (Match.player2_id == uid))
-        .count()
-    )
-
-    wins = Match.query.filter(
-        Match.status == "ended",
-        Match.winner_user_id == uid
-    ).count()
-
-    draws = (
-        Match.query
-        .filter(Match.status == "ended", Match.winner_user_id.is_(None))
-        .filter((Match.player1_id == uid) | (Match.player2_id == uid))
-        .count()
-    )
-
-    losses = max(0, total - wins - draws)
+    # счётчики ведёт finish_match (см. user_stats / flask backfill-stats)
+    st = read_db().get(UserStats, uid)
 
     return render_template(
         "stats.html",
         user=user,
-        total=total,
-        wins=wins,
-        losses=losses,
-        draws=draws,
+        total=st.ended if st else 0,
+        wins=st.wins if st else 0,
+        losses=st.losses if st else 0,
+        draws=st.draws if st else 0,
+        peak_rating=max(st.peak_rating, user.rating) if st else user.rating,
+        last_match_at=st.last_match_at if st else None,
+        rank=RATINGS.rank(uid),
+        players=len(RATINGS),
     )
 
 
+@app.route("/leaderboard")
+def leaderboard():
+    uid = session.get("user_id")
+    top = RATINGS.top(LEADERBOARD_TOP)
+    # окно "рядом со мной" — только если игрока нет в топе
+    around = []
+    if uid and not any(row["user_id"] == uid for row in top):
+        around = RATINGS.around(uid, LEADERBOARD_AROUND)
+    return render_template("leaderboard.html", top=top, around=around, me=uid, players=len(RATINGS))
+
+
 # ----------------------------
-if __name__ == "__main__":
+def run_server(host: str = "127.0.0.1", port: int = 5000, debug: bool = True):
     ensure_db()
-    socketio.run(app, host="127.0.0.1", port=5000, debug=True)
+    with app.app_context():
+        RATINGS.load()
+    resume_live_timers()
+    socketio.run(app, host=host, port=port, debug=debug)
+
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,486 @@
+"""
+Микробенчмарки горячих функций app.py на синтетических данных.
+
+    python bench/run.py --save           # записать базовую линию (bench/baseline.json)
+    python bench/run.py                  # сравнить с ней; регрессия > --tolerance -> код 1,
+                                         # нет базовой линии -> код 2 (--allow-missing-baseline — 0)
+    python bench/run.py --only pick_task --scale 0.1
+
+Всё работает офлайн: app импортируется с временным SQLite-файлом
+(DATABASE_URL), живое состояние — в памяти, хэши и запросы — прямо в потоке.
+Наборы данных (по умолчанию, --scale их масштабирует):
+  задачи           1k и 100k  — pick_task, pick_task_filtered, training_options
+  очередь поиска   10k        — find_best_opponent, remove_from_queue_*, plan_pairs
+  матчи            1M         — admin_users, user_stats
+  импорт           100k строк — admin_tasks_import (.jsonl)
+
+Время на вызов — медиана по --repeat повторам. Базовая линия хранит и размеры
+наборов: сравнивать прогоны с разным --scale нельзя.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+
+SUBJECTS = ("Математика", "Информатика", "Физика", "Русский язык")
+TOPICS = tuple(f"Тема {i}" for i in range(1, 31))
+
+SIZES = {
+    "tasks_small": 1_000,
+    "tasks_large": 100_000,
+    "queue": 10_000,
+    "users": 20_000,
+    "matches": 1_000_000,
+    "import_rows": 100_000,
+}
+
+
+def setup_env(workdir: str):
+    """
+    Окружение до импорта app: Config читает его при импорте.
+    """
+    os.environ.update(
+        {
+            "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+            "DATABASE_READONLY_URL": "",
+            "LIVE_STORE": "memory",
+            "DB_EXECUTOR": "inline",
+            "HASH_EXECUTOR": "inline",
+            "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        }
+    )
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+# ----------------------------
+# Cases
+# ----------------------------
+class Case:
+    """
+    Один замер: op() вызывается number раз подряд, repeat серий.
+    setup/teardown — вокруг каждой серии, в замер не входят.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        op: Callable,
+        number: int = 1,
+        repeat: int = 5,
+        setup: Optional[Callable] = None,
+        teardown: Optional[Callable] = None,
+    ):
+        self.name = name
+        self.op = op
+        self.number = number
+        self.repeat = repeat
+        self.setup = setup
+        self.teardown = teardown
+
+    def measure(self) -> Dict:
+        op = self.op
+        runs = []
+        for _ in range(self.repeat):
+            if self.setup:
+                self.setup()
+            started = time.perf_counter()
+            for _ in range(self.number):
+                op()
+            runs.append((time.perf_counter() - started) / self.number)
+            if self.teardown:
+                self.teardown()
+        return {
+            "median_us": round(statistics.median(runs) * 1e6, 3),
+            "min_us": round(min(runs) * 1e6, 3),
+            "number": self.number,
+            "repeat": self.repeat,
+        }
+
+
+class Bench:
+    def __init__(self, app_module, sizes: Dict[str, int], seed: int):
+        self.m = app_module
+        self.sizes = sizes
+        self.rnd = random.Random(seed)
+        random.seed(seed)
+
+    # --- наборы данных ---
+    def fill_tasks(self, total: int):
+        """
+        Догоняет таблицу task до total активных задач и перечитывает индекс.
+        """
+        m = self.m
+        have = m.db.session.query(m.Task.id).count()
+        rows = []
+        now = datetime.utcnow()
+        for i in range(have, total):
+            rows.append(
+                (
+                    SUBJECTS[i % len(SUBJECTS)],
+                    TOPICS[(i * 7) % len(TOPICS)],
+                    m.DIFFICULTIES[i % len(m.DIFFICULTIES)],
+                    f"Задача {i}: сколько будет {i} + 1?",
+                    str(i + 1),
+                    "number",
+                    1,
+                    now,
+                    now,
+                )
+            )
+        if rows:
+            with m.db.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "INSERT INTO task (subject, topic, difficulty, prompt, answer, kind, is_active, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        m.TASK_INDEX.invalidate()
+        m.TASK_INDEX.load()
+
+    def fill_matches(self, users: int, matches: int):
+        """
+        users игроков и matches завершённых матчей между ними; user_stats —
+        тем же rebuild_user_stats, что и flask backfill-stats.
+        """
+        m = self.m
+        rnd = self.rnd
+        now = datetime.utcnow()
+        with m.db.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO auth_user (id, username, password_hash, rating, created_at, is_admin) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (uid, f"user{uid:06d}", "x", int(rnd.gauss(1000, 150)), now, uid == 1)
+                    for uid in range(1, users + 1)
+                ],
+            )
+            batch = []
+            start = now - timedelta(days=365)
+            for match_id in range(1, matches + 1):
+                p1 = rnd.randint(1, users)
+                p2 = rnd.randint(1, users - 1)
+                if p2 >= p1:
+                    p2 += 1
+                r = rnd.random()
+                winner = p1 if r < 0.45 else (p2 if r < 0.9 else None)
+                started = start + timedelta(seconds=match_id * 30)
+                batch.append(
+                    (
+                        p1, p2, f"user{p1:06d}", f"user{p2:06d}", 1000, 1000, 600,
+                        started, started + timedelta(seconds=300), winner, "both_submitted", "ended",
+                    )
+                )
+                if len(batch) >= 50_000:
+                    self._insert_matches(conn, batch)
+                    batch = []
+            if batch:
+                self._insert_matches(conn, batch)
+        m.rebuild_user_stats()
+        m.RATINGS.load()
+
+    @staticmethod
+    def _insert_matches(conn, batch):
+        conn.exec_driver_sql(
+            "INSERT INTO matches (player1_id, player2_id, player1_name, player2_name, player1_rating, "
+            "player2_rating, duration_sec, started_at, ended_at, winner_user_id, reason, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+
+    def fill_queue(self, n: int):
+        m = self.m
+        now = time.time()
+        for uid in range(1, n + 1):
+            m.WAITING.add(
+                m.QueueEntry(
+                    user_id=uid,
+                    username=f"user{uid:06d}",
+                    rating=int(self.rnd.gauss(1000, 150)),
+                    sid=f"sid-{uid}",
+                    joined_at=now - self.rnd.uniform(0, 60),
+                )
+            )
+
+    # --- замеры ---
+    def task_cases(self, label: str) -> List[Case]:
+        m = self.m
+        combos = [
+            (s, t, d)
+            for s in ("Любой",) + SUBJECTS
+            for t in ("Любая",) + TOPICS[:5]
+            for d in ("Любая",) + m.DIFFICULTIES
+        ]
+        self.rnd.shuffle(combos)
+        combo = itertools.cycle(combos).__next__
+
+        def pick_filtered():
+            m.pick_task_filtered(*combo())
+
+        return [
+            Case(f"pick_task[{label}]", m.pick_task, number=20_000),
+            Case(f"pick_task_filtered[{label}]", pick_filtered, number=20_000),
+        ]
+
+    def queue_cases(self, label: str) -> List[Case]:
+        m = self.m
+        entries = list(m.WAITING)
+        probe = itertools.cycle(entries).__next__
+
+        def nearest():
+            m.find_best_opponent(probe())
+
+        def by_user():
+            e = probe()
+            m.remove_from_queue_by_user(e.user_id)
+            m.WAITING.add(e)
+
+        def by_sid():
+            e = probe()
+            m.remove_from_queue_by_sid(e.sid)
+            m.WAITING.add(e)
+
+        now = time.time()
+        return [
+            Case(f"find_best_opponent[{label}]", nearest, number=20_000),
+            Case(f"remove_from_queue_by_user+add[{label}]", by_user, number=20_000),
+            Case(f"remove_from_queue_by_sid+add[{label}]", by_sid, number=20_000),
+            Case(f"plan_pairs[{label}]", lambda: m.plan_pairs(entries, now), number=5),
+        ]
+
+    def training_options_case(self, label: str) -> Case:
+        m = self.m
+
+        def cold():
+            # как после правки задачи в админке: кэш опций устарел
+            m._TRAINING_OPTIONS["version"] = None
+            m.training_options()
+
+        return Case(f"training_options[{label}]", cold, number=20)
+
+    def page_cases(self, label: str) -> List[Case]:
+        m = self.m
+        client = m.app.test_client()
+        with client.session_transaction() as s:
+            s["user_id"] = 1
+            s["username"] = "user000001"
+
+        def get(url):
+            def op():
+                r = client.get(url)
+                assert r.status_code == 200, (url, r.status_code)
+
+            return op
+
+        return [
+            Case(f"admin_users[{label}]", get("/admin/users"), number=50),
+            Case(f"admin_users?q[{label}]", get("/admin/users?q=user01"), number=50),
+            Case(f"user_stats[{label}]", get("/stats"), number=200),
+        ]
+
+    def import_case(self, n: int, label: str) -> Case:
+        m = self.m
+        client = m.app.test_client()
+        with client.session_transaction() as s:
+            s["user_id"] = 1
+            s["username"] = "user000001"
+        lines = []
+        for i in range(n):
+            item = {
+                "subject": SUBJECTS[i % len(SUBJECTS)],
+                "topic": TOPICS[i % len(TOPICS)],
+                "prompt": f"Импорт {i}: 2 * {i} = ?",
+                "answer": str(2 * i),
+                "kind": "number",
+                "difficulty": m.DIFFICULTIES[i % 3],
+            }
+            lines.append(json.dumps(item, ensure_ascii=False))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        state = {}
+
+        def setup():
+            state["max_id"] = m.db.session.query(m.func.max(m.Task.id)).scalar() or 0
+            m.db.session.remove()
+
+        def op():
+            r = client.post(
+                "/admin/tasks/import",
+                data={"file": (io.BytesIO(payload), "bench.jsonl")},
+                content_type="multipart/form-data",
+            )
+            assert r.status_code == 200, r.status_code
+
+        def teardown():
+            # следующая серия снова вставляет, а не пропускает
+            with m.db.engine.begin() as conn:
+                conn.exec_driver_sql("DELETE FROM task WHERE id > ?", (state["max_id"],))
+            m.TASK_INDEX.invalidate()
+
+        return Case(f"admin_tasks_import[{label}]", op, number=1, repeat=3, setup=setup, teardown=teardown)
+
+    # --- прогон ---
+    def stages(self):
+        """
+        (что готовим, какие замеры) — по порядку: наборы растут, а не пересоздаются.
+        """
+        s = self.sizes
+        yield "tasks_small", lambda: self.fill_tasks(s["tasks_small"]), lambda: self.task_cases(label(s["tasks_small"]))
+        yield "tasks_large", lambda: self.fill_tasks(s["tasks_large"]), lambda: [
+            *self.task_cases(label(s["tasks_large"])),
+            self.training_options_case(label(s["tasks_large"])),
+        ]
+        yield "queue", lambda: self.fill_queue(s["queue"]), lambda: self.queue_cases(label(s["queue"]))
+        yield "matches", lambda: self.fill_matches(s["users"], s["matches"]), lambda: self.page_cases(
+            label(s["matches"]) + " matches"
+        )
+        yield "import", lambda: None, lambda: [self.import_case(s["import_rows"], label(s["import_rows"]))]
+
+
+def label(n: int) -> str:
+    if n >= 1_000_000 and n % 1_000_000 == 0:
+        return f"{n // 1_000_000}M"
+    if n >= 1_000 and n % 1_000 == 0:
+        return f"{n // 1_000}k"
+    return str(n)
+
+
+def run_cases(bench: Bench, only: List[str]) -> Dict[str, Dict]:
+    m = bench.m
+    results = {}
+    with m.app.app_context():
+        m.ensure_db()
+        for stage, prepare, cases in bench.stages():
+            started = time.perf_counter()
+            prepare()
+            m.db.session.remove()
+            print(f"# {stage}: данные за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+            for case in cases():
+                if only and not any(p in case.name for p in only):
+                    continue
+                results[case.name] = case.measure()
+                m.db.session.remove()
+                print(f"{case.name:<48}{results[case.name]['median_us']:>14.1f} us", file=sys.stderr)
+    return results
+
+
+# ----------------------------
+# Baseline
+# ----------------------------
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Строки отчёта; регрессией считается медиана > базовой * (1 + tolerance).
+    """
+    regressions = []
+    print()
+    print(f"{'case':<48}{'base us':>12}{'now us':>12}{'change':>9}")
+    for name, now in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:<48}{'—':>12}{now['median_us']:>12.1f}{'new':>9}")
+            continue
+        change = now["median_us"] / base["median_us"] - 1 if base["median_us"] else 0.0
+        mark = ""
+        if change > tolerance:
+            mark = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<48}{base['median_us']:>12.1f}{now['median_us']:>12.1f}{change:>+9.0%}{mark}")
+    return regressions
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Микробенчмарки app.py с базовой линией в JSON.")
+    p.add_argument("--baseline", default=DEFAULT_BASELINE, help="файл базовой линии")
+    p.add_argument("--save", action="store_true", help="записать результаты как базовую линию")
+    p.add_argument(
+        "--allow-missing-baseline",
+        action="store_true",
+        help="без базовой линии только показать замеры и выйти с кодом 0",
+    )
+    p.add_argument("--tolerance", type=float, default=0.25, help="допустимое замедление, доля (0.25 = +25%%)")
+    p.add_argument("--scale", type=float, default=1.0, help="множитель размеров наборов данных")
+    p.add_argument("--only", action="append", default=[], help="только замеры, в имени которых есть подстрока")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", dest="json_path", help="сохранить результаты прогона в файл")
+    p.add_argument("--keep", action="store_true", help="не удалять временную БД")
+    return p.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    sizes = {k: max(2, int(v * args.scale)) for k, v in SIZES.items()}
+    # сравнивать не с чем — гейт не должен молча проходить; падаем до долгих замеров
+    missing = not args.save and not os.path.exists(args.baseline)
+    if missing and not args.allow_missing_baseline:
+        print(f"нет базовой линии {args.baseline} — запусти с --save (или --allow-missing-baseline)")
+        return 2
+
+    workdir = tempfile.mkdtemp(prefix="examarena-bench-")
+    setup_env(workdir)
+    try:
+        import app as app_module
+
+        results = run_cases(Bench(app_module, sizes, args.seed), args.only)
+    finally:
+        if args.keep:
+            print(f"# временная БД: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    doc = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+        },
+        "results": results,
+    }
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+
+    if args.save:
+        if args.only and os.path.exists(args.baseline):
+            # частичный прогон обновляет только свои замеры
+            with open(args.baseline, encoding="utf-8") as f:
+                old = json.load(f)
+            if old["meta"]["sizes"] == sizes:
+                doc["results"] = {**old["results"], **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+        print(f"\nбазовая линия записана: {args.baseline}")
+        return 0
+
+    if missing:
+        print(f"\nнет базовой линии {args.baseline} — сравнение пропущено (--allow-missing-baseline)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"]["sizes"] != sizes:
+        print(f"\nбазовая линия снята на других размерах данных: {baseline['meta']['sizes']}")
+        return 2
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\nрегрессии (> {args.tolerance:+.0%}): {', '.join(regressions)}")
+        return 1
+    print(f"\nрегрессий нет (допуск {args.tolerance:+.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
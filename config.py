@@ -1,10 +1,96 @@
 import os
 
+# профиль движка БД:
+#   "sqlite-wal" — WAL, synchronous=NORMAL, busy_timeout, mmap/cache, пул под eventlet
+#   "default"    — настройки SQLAlchemy по умолчанию
+DB_PROFILE = os.environ.get("DB_PROFILE", "sqlite-wal")
+
+
+def _engine_options(profile: str, uri: str) -> dict:
+    if profile != "sqlite-wal" or not uri.startswith("sqlite"):
+        return {}
+    options = {
+        # гринлеты eventlet живут в одном потоке, соединение может переходить между ними
+        "connect_args": {
+            "check_same_thread": False,
+            "timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")) / 1000.0,
+        },
+    }
+    if uri not in ("sqlite://", "sqlite:///:memory:"):
+        # файловая БД: обычный QueuePool
+        options.update(
+            pool_size=int(os.environ.get("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT", "10")),
+        )
+    return options
+
+
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret")
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///examarena.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    DB_PROFILE = DB_PROFILE
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(DB_PROFILE, SQLALCHEMY_DATABASE_URI)
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+
+    # отдельный read-only движок для статистики и админки:
+    # "" — не нужен, "auto" — тот же файл SQLite в режиме mode=ro, иначе — свой URL
+    DATABASE_READONLY_URL = os.environ.get("DATABASE_READONLY_URL", "")
+
+    # запросы из сокет-обработчиков: "tpool" — пул нативных потоков eventlet, "inline" — прямо в гринлете
+    DB_EXECUTOR = os.environ.get("DB_EXECUTOR", "tpool")
+    DB_THREADS = int(os.environ.get("DB_THREADS", "8"))
+
+    # хэши паролей: "process" — пул процессов, "inline" — прямо в обработчике
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    HASH_EXECUTOR = os.environ.get("HASH_EXECUTOR", "process")
+    HASH_WORKERS = int(os.environ.get("HASH_WORKERS", str(os.cpu_count() or 2)))
+    HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", "64"))  # сверх — сразу отказ
+
+    # кэш профилей игроков (username, rating) для сокет-обработчиков
+    USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "50000"))
+
+    # индекс мест по рейтингу: перечитывать из БД раз в N сек (0 — только при старте);
+    # при нескольких воркерах рейтинги меняют и соседи, тогда стоит задать, например, 60
+    RATING_INDEX_REFRESH = float(os.environ.get("RATING_INDEX_REFRESH", "0"))
+
+    # живое состояние (очередь, матчи, тренировки):
+    #   "memory" — в памяти процесса (один воркер)
+    #   "sqlite" — общий файл LIVE_STORE_PATH, можно запускать несколько воркеров на одном хосте
+    LIVE_STORE = os.environ.get("LIVE_STORE", "memory")
+    LIVE_STORE_PATH = os.environ.get("LIVE_STORE_PATH", "examarena-live.db")
+    # очередь сообщений Socket.IO между воркерами (например, redis://localhost:6379/0)
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+
     # матч по умолчанию (сек)
     DEFAULT_MATCH_SECONDS = int(os.environ.get("MATCH_SECONDS", "600"))  # 10 минут
-    ELO_K = int(os.environ.get("ELO_K", "32"))
\ No newline at end of file
+    ELO_K = int(os.environ.get("ELO_K", "32"))
+
+    # подбор соперников: фоновый цикл раз в MATCHMAKING_INTERVAL сек,
+    # допустимая разница рейтингов растёт со временем ожидания
+    MATCHMAKING_INTERVAL = float(os.environ.get("MATCHMAKING_INTERVAL", "1.0"))
+    MATCH_WINDOW_BASE = int(os.environ.get("MATCH_WINDOW_BASE", "50"))
+    MATCH_WINDOW_GROWTH = float(os.environ.get("MATCH_WINDOW_GROWTH", "10"))  # за секунду ожидания
+    MATCH_WINDOW_MAX = int(os.environ.get("MATCH_WINDOW_MAX", "1000"))
+
+    # клиент сам считает таймер от дедлайна; тики — только редкая пересинхронизация (0 = выкл.)
+    TICK_RESYNC_SECONDS = float(os.environ.get("TICK_RESYNC_SECONDS", "15"))
+
+    # уборка брошенных сессий: раз в REAPER_INTERVAL сек
+    REAPER_INTERVAL = float(os.environ.get("REAPER_INTERVAL", "30"))
+    TRAINING_IDLE_TTL = int(os.environ.get("TRAINING_IDLE_TTL", "1800"))  # без действий игрока
+    PENDING_MATCH_TTL = int(os.environ.get("PENDING_MATCH_TTL", "300"))  # матч так и не начался
+    QUEUE_TTL = int(os.environ.get("QUEUE_TTL", "900"))  # в поиске соперника
+    # матч "started" без живого состояния и итога через столько сек после конца — abandoned
+    LOST_MATCH_GRACE = int(os.environ.get("LOST_MATCH_GRACE", "300"))
+
+    # итоги матчей пишутся в БД пачками раз в RESULTS_FLUSH_INTERVAL сек
+    RESULTS_FLUSH_INTERVAL = float(os.environ.get("RESULTS_FLUSH_INTERVAL", "0.2"))
+    RESULTS_BATCH = int(os.environ.get("RESULTS_BATCH", "200"))
+    # итог в общем хранилище, не записанный за столько сек, дописывает reaper (воркер упал)
+    RESULTS_RECOVER_AFTER = float(os.environ.get("RESULTS_RECOVER_AFTER", "60"))
@@ -9,7 +9,7 @@ class AuthUser(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(32), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(255), nullable=False)
-    rating = db.Column(db.Integer, nullable=False, default=1000)
+    rating = db.Column(db.Integer, nullable=False, default=1000, index=True)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_login_at = db.Column(db.DateTime, nullable=True)
@@ -38,7 +38,7 @@ class Match(db.Model):
     winner_user_id = db.Column(db.Integer, nullable=True)
     reason = db.Column(db.String(32), nullable=True)
 
-    status = db.Column(db.String(16), nullable=False, default="pending")
+    status = db.Column(db.String(16), nullable=False, default="pending", index=True)
 
     from datetime import datetime
 
@@ -61,3 +61,21 @@ class Task(db.Model):
 
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UserStats(db.Model):
+    """
+    Денормализованные счётчики PvP по пользователю.
+    Обновляются в той же транзакции, что и Elo в finish_match.
+    """
+    __tablename__ = "user_stats"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("auth_user.id"), primary_key=True)
+
+    ended = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    losses = db.Column(db.Integer, nullable=False, default=0)
+    draws = db.Column(db.Integer, nullable=False, default=0)
+
+    last_match_at = db.Column(db.DateTime, nullable=True)
+    peak_rating = db.Column(db.Integer, nullable=False, default=1000)
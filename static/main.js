@@ -32,6 +32,41 @@ function fmtTime(sec) {
   return `${String(m).padStart(2, "0")}:${String(s).padStart(2, "0")}`;
 }
 
+// Таймер считается на клиенте от серверного дедлайна.
+// server_time из того же сообщения даёт поправку на расхождение часов.
+function makeCountdown(el) {
+  let deadline = null;
+  let offset = 0;
+  let timer = null;
+
+  function render() {
+    if (!el || deadline == null) return;
+    const left = Math.ceil((deadline - (Date.now() + offset)) / 1000);
+    el.textContent = fmtTime(left);
+    if (left <= 0) stop();
+  }
+
+  function stop() {
+    if (timer) clearInterval(timer);
+    timer = null;
+  }
+
+  function sync(p) {
+    if (!p) return;
+    if (p.server_time != null) offset = p.server_time - Date.now();
+    deadline = p.deadline ?? null;
+    if (deadline == null) {
+      stop();
+      if (el) el.textContent = fmtTime(p.seconds_left ?? 0);
+      return;
+    }
+    render();
+    if (!timer) timer = setInterval(render, 250);
+  }
+
+  return { sync, stop };
+}
+
 function fillSelect(sel, items, selectedValue) {
   if (!sel) return;
   sel.innerHTML = "";
@@ -116,6 +151,7 @@ function fillSelect(sel, items, selectedValue) {
     const btnSubmit = qs("btnSubmit");
     const btnSurrender = qs("btnSurrender");
     const resultEl = qs("result");
+    const countdown = makeCountdown(timerEl);
 
     socket.emit("match:join", { match_id: PAGE.matchId });
 
@@ -127,18 +163,15 @@ function fillSelect(sel, items, selectedValue) {
       if (promptEl) promptEl.textContent = t.prompt || "";
     });
 
-    socket.on("match:state", (st) => {
-      if (timerEl) timerEl.textContent = fmtTime(st.seconds_left);
-    });
+    socket.on("match:state", (st) => countdown.sync(st));
 
     socket.on("match:started", (p) => {
-      if (timerEl) timerEl.textContent = fmtTime(p.seconds_left);
+      countdown.sync(p);
       showToast("primary", "Матч начался!");
     });
 
-    socket.on("match:tick", (p) => {
-      if (timerEl) timerEl.textContent = fmtTime(p.seconds_left);
-    });
+    // редкая пересинхронизация
+    socket.on("match:tick", (p) => countdown.sync(p));
 
     btnSubmit?.addEventListener("click", () => {
       const ans = (inputEl?.value || "").trim();
@@ -156,6 +189,7 @@ function fillSelect(sel, items, selectedValue) {
     });
 
     socket.on("match:ended", (p) => {
+      countdown.stop();
       const winnerId = p.winner_user_id;
 
       const p1ok = p.p1_correct ? "✅" : "❌";
@@ -205,8 +239,65 @@ function fillSelect(sel, items, selectedValue) {
     const selSubject = qs("selSubject");
     const selTopic = qs("selTopic");
     const selDifficulty = qs("selDifficulty");
+    const countdown = makeCountdown(timerEl);
 
     let suppressFilterEmit = false;
+    let optionCounts = null;
+
+    const OPTIONS_CACHE_KEY = "trainingOptions";
+
+    function loadCachedOptions() {
+      try {
+        return JSON.parse(localStorage.getItem(OPTIONS_CACHE_KEY) || "null");
+      } catch (_) {
+        return null;
+      }
+    }
+
+    function saveCachedOptions(opt) {
+      try {
+        localStorage.setItem(OPTIONS_CACHE_KEY, JSON.stringify(opt));
+      } catch (_) {}
+    }
+
+    // серим варианты, под которые (с учётом двух других селектов) нет задач
+    function applyOptionCounts() {
+      if (!optionCounts) return;
+      const cur = {
+        subject: selSubject?.value || "Любой",
+        topic: selTopic?.value || "Любая",
+        difficulty: selDifficulty?.value || "Любая",
+      };
+      const countOf = (s, t, d) => optionCounts[`${s}|${t}|${d}`] || 0;
+
+      for (const o of (selSubject?.options || [])) {
+        o.disabled = o.value !== cur.subject && countOf(o.value, cur.topic, cur.difficulty) === 0;
+      }
+      for (const o of (selTopic?.options || [])) {
+        o.disabled = o.value !== cur.topic && countOf(cur.subject, o.value, cur.difficulty) === 0;
+      }
+      for (const o of (selDifficulty?.options || [])) {
+        o.disabled = o.value !== cur.difficulty && countOf(cur.subject, cur.topic, o.value) === 0;
+      }
+    }
+
+    function renderOptions(opt) {
+      suppressFilterEmit = true;
+
+      const subjects = opt?.subjects || ["Любой"];
+      const topics = opt?.topics || ["Любая"];
+      const diffs = opt?.difficulties || ["Любая", "Легкая", "Средняя", "Сложная"];
+
+      fillSelect(selSubject, subjects, selSubject?.value || "Любой");
+      fillSelect(selTopic, topics, selTopic?.value || "Любая");
+      fillSelect(selDifficulty, diffs, selDifficulty?.value || "Любая");
+
+      optionCounts = {};
+      for (const [s, t, d, n] of (opt?.counts || [])) optionCounts[`${s}|${t}|${d}`] = n;
+      applyOptionCounts();
+
+      suppressFilterEmit = false;
+    }
 
     // Заголовок БЕЗ предмета (чтобы не было "Информатика ...")
     function setHeader(_subject, topic, diff) {
@@ -233,6 +324,7 @@ function fillSelect(sel, items, selectedValue) {
     }
 
     function applyFilters() {
+      applyOptionCounts();
       if (suppressFilterEmit) return;
       socket.emit("training:set_filters", {
         subject: selSubject?.value || "Любой",
@@ -241,21 +333,14 @@ function fillSelect(sel, items, selectedValue) {
       });
     }
 
-    // join
-    socket.emit("training:join", {});
+    // join: если опции уже есть в кэше — рисуем сразу, сервер пришлёт новые только при смене версии
+    const cachedOptions = loadCachedOptions();
+    if (cachedOptions) renderOptions(cachedOptions);
+    socket.emit("training:join", { options_version: cachedOptions?.version ?? null });
 
     socket.on("training:options", (opt) => {
-      suppressFilterEmit = true;
-
-      const subjects = opt?.subjects || ["Любой"];
-      const topics = opt?.topics || ["Любая"];
-      const diffs = opt?.difficulties || ["Любая", "Легкая", "Средняя", "Сложная"];
-
-      fillSelect(selSubject, subjects, selSubject?.value || "Любой");
-      fillSelect(selTopic, topics, selTopic?.value || "Любая");
-      fillSelect(selDifficulty, diffs, selDifficulty?.value || "Любая");
-
-      suppressFilterEmit = false;
+      saveCachedOptions(opt);
+      renderOptions(opt);
     });
 
     socket.on("training:task", (t) => {
@@ -266,21 +351,21 @@ function fillSelect(sel, items, selectedValue) {
         if (selSubject) selSubject.value = filters.subject || "Любой";
         if (selTopic) selTopic.value = filters.topic || "Любая";
         if (selDifficulty) selDifficulty.value = filters.difficulty || "Любая";
+        applyOptionCounts();
         suppressFilterEmit = false;
       }
 
       setHeader(t.subject, t.topic, t.difficulty);
       if (promptEl) promptEl.textContent = t.prompt || "";
-      if (timerEl) timerEl.textContent = fmtTime(t.seconds_left ?? 0);
+      countdown.sync(t);
       setStats(t.stats);
 
       if (resultEl) resultEl.innerHTML = "";
       resetInput();
     });
 
-    socket.on("training:tick", (p) => {
-      if (timerEl) timerEl.textContent = fmtTime(p.seconds_left ?? 0);
-    });
+    // редкая пересинхронизация
+    socket.on("training:tick", (p) => countdown.sync(p));
 
     selSubject?.addEventListener("change", applyFilters);
     selTopic?.addEventListener("change", applyFilters);
@@ -306,6 +391,7 @@ function fillSelect(sel, items, selectedValue) {
 
     btnStop?.addEventListener("click", () => {
       socket.emit("training:leave", {});
+      countdown.stop();
       if (btnSubmit) btnSubmit.disabled = true;
       if (inputEl) inputEl.disabled = true;
       showToast("secondary", "Тренировка остановлена");
@@ -315,6 +401,7 @@ function fillSelect(sel, items, selectedValue) {
       const ok = !!p.correct;
       const reason = p.reason || "answer";
       const correctAnswer = p.correct_answer ?? "—";
+      countdown.stop();
 
       setStats(p.stats);
 
@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# Config читает окружение при импорте app — временная БД и быстрые настройки до импорта
+_TMP = tempfile.mkdtemp(prefix="examarena-tests-")
+os.environ.update(
+    {
+        "DATABASE_URL": "sqlite:///" + os.path.join(_TMP, "test.db"),
+        "DATABASE_READONLY_URL": "",
+        "LIVE_STORE": "memory",
+        "HASH_EXECUTOR": "inline",
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        "MATCHMAKING_INTERVAL": "0.05",
+    }
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+from models import AuthUser, db  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def A():
+    app_module.app.config["TESTING"] = True
+    app_module.ensure_db()
+    return app_module
+
+
+@pytest.fixture
+def make_user(A):
+    """
+    Новый игрок с уникальным логином; возвращает (user_id, залогиненный test_client).
+    """
+
+    def make(rating: int = 1000, is_admin: bool = False):
+        name = "u" + uuid.uuid4().hex[:10]
+        with A.app.app_context():
+            user = AuthUser(
+                username=name,
+                password_hash=A.PASSWORDS.hash("secret1"),
+                rating=rating,
+                is_admin=is_admin,
+            )
+            db.session.add(user)
+            db.session.commit()
+            uid = user.id
+        client = A.app.test_client()
+        with client.session_transaction() as s:
+            s["user_id"] = uid
+            s["username"] = name
+        return uid, client
+
+    return make
@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "answer, submitted, ok",
+    [
+        ("135", "531", True),
+        ("135", "1;3;5", True),
+        ("135", "5 3 1", True),
+        ("135", "1135", False),
+        ("1135", "135", False),
+        ("1 1 3 5", "1 3 5", False),
+        ("1 1 3 5", "5,1,3,1", True),
+        ("12|21", "12", True),
+    ],
+)
+def test_set_answer(A, answer, submitted, ok):
+    assert A.AnswerMatcher("set", answer)(submitted) is ok
+
+
+@pytest.mark.parametrize("submitted, ok", [("0.5", True), (".50", True), ("0,5", True), ("0.6", False)])
+def test_number_answer(A, submitted, ok):
+    assert A.AnswerMatcher("number", "0.5")(submitted) is ok
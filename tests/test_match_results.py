@@ -0,0 +1,60 @@
+import time
+
+from models import AuthUser, Match, db
+
+
+def wait_event(A, sio_client, name: str, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    received = []
+    while time.monotonic() < deadline:
+        received += sio_client.get_received()
+        for packet in received:
+            if packet["name"] == name:
+                return packet["args"][0]
+        A.socketio.sleep(0.02)
+    raise AssertionError(f"no {name}: {[p['name'] for p in received]}")
+
+
+def play_match(A, sa, sb, answer_a: str, answer_b: str) -> int:
+    sa.emit("queue:join", {})
+    sb.emit("queue:join", {})
+    match_id = wait_event(A, sa, "match:found")["match_id"]
+    wait_event(A, sb, "match:found")
+
+    sa.emit("match:join", {"match_id": match_id})
+    sb.emit("match:join", {"match_id": match_id})
+    wait_event(A, sa, "match:started")
+    with A.app.app_context():
+        correct = A.LIVE_MATCHES[match_id].task.answer
+    sa.emit("match:submit_answer", {"match_id": match_id, "answer": answer_a or correct})
+    sb.emit("match:submit_answer", {"match_id": match_id, "answer": answer_b or correct})
+    return match_id
+
+
+def test_requeue_before_results_flush_uses_new_rating(A, make_user):
+    a_id, ca = make_user()
+    b_id, cb = make_user()
+    sa = A.socketio.test_client(A.app, flask_test_client=ca)
+    sb = A.socketio.test_client(A.app, flask_test_client=cb)
+
+    # a отвечает верно, b — нет
+    first = play_match(A, sa, sb, "", "definitely wrong")
+    ended = wait_event(A, sa, "match:ended")
+    assert ended["winner_user_id"] == a_id
+    wait_event(A, sb, "match:ended")
+    # итог ещё в очереди писателя — сразу снова в поиск
+    assert A.MATCH_RESULTS.is_pending(first)
+
+    sa.emit("queue:join", {})
+    sb.emit("queue:join", {})
+    second = wait_event(A, sa, "match:found")["match_id"]
+
+    with A.app.app_context():
+        ratings = {u.id: u.rating for u in db.session.query(AuthUser).filter(AuthUser.id.in_((a_id, b_id)))}
+        m = db.session.get(Match, second)
+        recorded = {m.player1_id: m.player1_rating, m.player2_id: m.player2_rating}
+    assert ratings[a_id] > 1000 > ratings[b_id]
+    assert recorded == ratings
+
+    sa.disconnect()
+    sb.disconnect()
@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.mark.parametrize("method", ["scrypt", "pbkdf2:sha256", "pbkdf2:sha256:1000"])
+def test_fresh_hash_does_not_need_rehash(A, method):
+    hasher = A.PasswordHasher(1, 4, "inline", method)
+    pwhash = hasher.hash("secret1")
+    assert hasher.verify(pwhash, "secret1")
+    assert not hasher.needs_rehash(pwhash)
+
+
+def test_hash_with_other_params_needs_rehash(A):
+    old = A.PasswordHasher(1, 4, "inline", "pbkdf2:sha256:1000").hash("secret1")
+    assert A.PasswordHasher(1, 4, "inline", "scrypt").needs_rehash(old)
+    assert A.PasswordHasher(1, 4, "inline", "pbkdf2:sha256").needs_rehash(old)
@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def shared(A, tmp_path):
+    return A.SqliteStore(str(tmp_path / "live.db")).queue()
+
+
+def test_shared_queue_matches_memory_queue(A, shared):
+    rnd = random.Random(7)
+    memory = A.MatchQueue()
+    joined = 1_760_000_000.0
+    for step in range(600):
+        op = rnd.random()
+        user_id = rnd.randrange(40)
+        if op < 0.55:
+            joined += rnd.choice((0.25, 1.0))
+            rating = rnd.choice((-50, 990, 1000, 1000, 1010, 1200))
+            e = A.QueueEntry(user_id, f"u{user_id}", rating, f"s{rnd.randrange(60)}", joined)
+            memory.add(e)
+            shared.add(e)
+        elif op < 0.75:
+            assert shared.remove_user(user_id) == memory.remove_user(user_id)
+        else:
+            sid = f"s{rnd.randrange(60)}"
+            assert shared.remove_sid(sid) == memory.remove_sid(sid)
+
+        assert len(shared) == len(memory)
+        rating = rnd.choice((-100, 995, 1000, 1005, 1100, 1500))
+        exclude = rnd.randrange(40)
+        assert shared.nearest(rating, exclude) == memory.nearest(rating, exclude), step
+
+
+def test_shared_queue_skips_stale_index_rows(A, shared):
+    a = A.QueueEntry(1, "a", 1000, "sa", 1.0)
+    b = A.QueueEntry(2, "b", 1100, "sb", 2.0)
+    shared.add(a)
+    shared.add(b)
+    # воркер упал между записями: в очереди записи уже нет, в индексах — осталась
+    shared.table.pop(1)
+
+    assert shared.nearest(1000, exclude_user=3) == b
+    assert shared.remove_sid("sa") is None
+    assert len(shared.by_rating) == 1
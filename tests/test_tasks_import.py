@@ -0,0 +1,36 @@
+import io
+import json
+
+
+def broken_reload(*_args):
+    raise RuntimeError("reload failed")
+
+
+def post_import(client, name: str, body: bytes):
+    return client.post(
+        "/admin/tasks/import",
+        data={"file": (io.BytesIO(body), name)},
+        content_type="multipart/form-data",
+    )
+
+
+def test_failed_reload_keeps_import_report(A, make_user, monkeypatch):
+    _uid, client = make_user(is_admin=True)
+    monkeypatch.setattr(A.TASK_INDEX, "load", broken_reload)
+
+    row = {"subject": "Математика", "topic": "Импорт", "prompt": "2+2", "answer": "4"}
+    resp = post_import(client, "tasks.jsonl", json.dumps(row, ensure_ascii=False).encode())
+
+    assert resp.status_code == 200
+    assert "Создано: <b>1</b>" in resp.get_data(as_text=True)
+    assert A.TASK_INDEX.stale
+
+
+def test_failed_reload_keeps_import_error(A, make_user, monkeypatch):
+    _uid, client = make_user(is_admin=True)
+    monkeypatch.setattr(A.TASK_INDEX, "load", broken_reload)
+
+    resp = post_import(client, "tasks.json", b'{"not": "a list"}')
+
+    assert resp.status_code == 200
+    assert "JSON должен быть массивом объектов." in resp.get_data(as_text=True)
@@ -0,0 +1,36 @@
+import time
+
+from test_match_results import play_match, wait_event
+
+
+def test_cancel_by_handle_keeps_newer_timer_with_same_args(A):
+    fired = []
+    timers = A.DeadlineScheduler()
+    old = timers.schedule(time.time() + 0.1, fired.append, "x")
+    new = timers.schedule(time.time() + 0.1, fired.append, "x")
+    timers.cancel(old)
+    timers.cancel(old)
+    assert timers.stats()["scheduled"] == 1
+
+    deadline = time.monotonic() + 2
+    while not fired and time.monotonic() < deadline:
+        A.socketio.sleep(0.05)
+    assert fired == ["x"]
+    assert new not in timers.pending
+    assert timers.stats()["scheduled"] == 0
+
+
+def test_finished_match_cancels_its_timer(A, make_user):
+    _a_id, ca = make_user()
+    _b_id, cb = make_user()
+    sa = A.socketio.test_client(A.app, flask_test_client=ca)
+    sb = A.socketio.test_client(A.app, flask_test_client=cb)
+
+    scheduled = A.TIMERS.stats()["scheduled"]
+    match_id = play_match(A, sa, sb, "", "")
+    wait_event(A, sa, "match:ended")
+    assert match_id not in A.MATCH_TIMERS
+    assert A.TIMERS.stats()["scheduled"] == scheduled
+
+    sa.disconnect()
+    sb.disconnect()
@@ -0,0 +1,28 @@
+from sqlalchemy import event
+
+from models import Task, db
+
+
+def test_training_options_come_from_task_index(A):
+    with A.app.app_context():
+        db.session.add_all(
+            [
+                Task(subject="Физика", topic="Кинематика", prompt="p", answer="1", difficulty="Легкая"),
+                Task(subject="Химия", topic="Скрытая", prompt="p", answer="1", difficulty="Легкая", is_active=False),
+            ]
+        )
+        db.session.commit()
+        A.TASK_INDEX.invalidate()
+        A.TASK_INDEX.load()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])  # noqa: E731
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            options = A.training_options()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+    assert not [sql for sql in statements if "DISTINCT" in sql.upper()]
+    assert "Физика" in options["subjects"] and "Кинематика" in options["topics"]
+    assert "Химия" not in options["subjects"] and "Скрытая" not in options["topics"]
@@ -0,0 +1,515 @@
+"""
+Нагрузочный тест: синтетические игроки через клиент python-socketio.
+
+    pip install "python-socketio[client]==5.11.3"
+    python tools/loadtest.py --spawn --users 200 --rate 20 --rounds 3
+    python tools/loadtest.py --url http://127.0.0.1:5000 --users 100 --training 0.3 --json before.json
+
+Каждый игрок входит (или регистрируется) по HTTP, подключается к Socket.IO
+со своей сессионной кукой и дальше играет:
+  дуэли      — queue:join → match:found → match:join → match:started →
+               match:submit_answer → match:ended;
+  тренировки — training:join → training:task → training:submit_answer →
+               training:result → следующая training:task.
+
+Игроки приходят пуассоновским потоком с интенсивностью --rate в секунду.
+В конце печатаются p50/p95/p99 задержек и счётчики ошибок; --json сохраняет
+то же самое в файл, чтобы сравнивать релизы.
+
+С --spawn скрипт сам поднимает сервер на свободном порту с временной БД
+(настоящая examarena.db не трогается) и гасит его после прогона.
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+try:
+    import requests
+    import socketio
+except ImportError:  # pragma: no cover
+    sys.exit('нужен клиент Socket.IO: pip install "python-socketio[client]==5.11.3"')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "loadtest-password"
+
+
+# ----------------------------
+# Metrics
+# ----------------------------
+def percentile(sorted_values: List[float], p: float) -> float:
+    # nearest-rank: p99 из 100 замеров — 99-й по величине
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(math.ceil(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+class Metrics:
+    """
+    Замеры (секунды) и счётчики со всех потоков клиентов.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Counter = Counter()
+        self.counters: Counter = Counter()
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def error(self, kind: str):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] += n
+
+    def summary(self) -> Dict:
+        with self.lock:
+            latency = {}
+            for name, values in sorted(self.samples.items()):
+                values = sorted(values)
+                latency[name] = {
+                    "count": len(values),
+                    "p50_ms": round(percentile(values, 50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 95) * 1000, 2),
+                    "p99_ms": round(percentile(values, 99) * 1000, 2),
+                    "max_ms": round(values[-1] * 1000, 2),
+                }
+            return {
+                "latency": latency,
+                "errors": dict(self.errors.most_common()),
+                "counters": dict(self.counters),
+            }
+
+
+class MatchBook:
+    """
+    Общая для всех игроков запись об отправленных ответах: задержку
+    submit → match:ended меряем от последнего ответа в матче — именно он
+    завершает матч на сервере.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_submit: Dict[int, float] = {}
+        self.seen: Counter = Counter()
+
+    def submitted(self, match_id: int, ts: float):
+        with self.lock:
+            self.last_submit[match_id] = max(ts, self.last_submit.get(match_id, 0.0))
+
+    def ended(self, match_id: int) -> Optional[float]:
+        with self.lock:
+            ts = self.last_submit.get(match_id)
+            self.seen[match_id] += 1
+            if self.seen[match_id] >= 2:
+                self.last_submit.pop(match_id, None)
+                self.seen.pop(match_id, None)
+            return ts
+
+
+# ----------------------------
+# Player
+# ----------------------------
+class RoundFailed(Exception):
+    pass
+
+
+class Player:
+    """
+    Один синтетический игрок: свой HTTP-клиент, свой сокет и входящая
+    очередь событий. Сценарий идёт линейно в потоке игрока, обработчики
+    сокета только складывают события в очередь (и сами считают тики).
+    """
+
+    TRACKED = (
+        "queue:status",
+        "match:found",
+        "match:task",
+        "match:state",
+        "match:started",
+        "match:submitted",
+        "match:ended",
+        "training:options",
+        "training:task",
+        "training:result",
+    )
+
+    def __init__(self, run: "LoadRun", index: int, mode: str):
+        self.run = run
+        self.args = run.args
+        self.metrics = run.metrics
+        self.username = f"{self.args.prefix}{index:05d}"
+        self.mode = mode
+        self.inbox: "queue.Queue" = queue.Queue()
+        self.last_tick: Optional[float] = None
+        self.sio: Optional[socketio.Client] = None
+
+    # --- соединение ---
+    def login(self) -> str:
+        http = requests.Session()
+        base = self.args.url
+        for attempt in range(5):
+            r = http.post(
+                f"{base}/login",
+                data={"username": self.username, "password": PASSWORD},
+                allow_redirects=False,
+                timeout=self.args.timeout,
+            )
+            if r.status_code == 200:
+                r = http.post(
+                    f"{base}/register",
+                    data={"username": self.username, "password": PASSWORD, "password2": PASSWORD},
+                    allow_redirects=False,
+                    timeout=self.args.timeout,
+                )
+            if r.status_code == 302 and "session" in http.cookies:
+                return "; ".join(f"{k}={v}" for k, v in http.cookies.items())
+            if r.status_code == 503:
+                # пул хэшей паролей занят — подождём
+                time.sleep(0.5 * (attempt + 1))
+                continue
+            break
+        raise RoundFailed(f"auth:{r.status_code}")
+
+    def connect(self, cookie: str):
+        sio = socketio.Client(reconnection=False)
+        for name in self.TRACKED:
+            sio.on(name, self._inbox_handler(name))
+        sio.on("match:tick", self.on_tick)
+        sio.on("training:tick", self.on_tick)
+        sio.on("toast", self.on_toast)
+        sio.on("disconnect", lambda: self.inbox.put(("disconnect", None, time.perf_counter())))
+        sio.connect(
+            self.args.url,
+            headers={"Cookie": cookie},
+            transports=self.args.transports,
+            wait_timeout=self.args.timeout,
+        )
+        self.sio = sio
+
+    def _inbox_handler(self, name: str):
+        def handler(data=None):
+            self.inbox.put((name, data, time.perf_counter()))
+
+        return handler
+
+    def on_tick(self, data):
+        now = time.perf_counter()
+        # сервер и скрипт на одной машине — сравниваем с его временем напрямую
+        server_time = (data or {}).get("server_time")
+        if server_time:
+            self.metrics.observe("tick_lag", max(0.0, time.time() - server_time / 1000.0))
+        if self.last_tick is not None:
+            self.metrics.observe("tick_jitter", abs(now - self.last_tick - self.args.tick_interval))
+        self.last_tick = now
+
+    def on_toast(self, data):
+        data = data or {}
+        if data.get("type") in ("danger", "warning"):
+            self.metrics.error(f"toast:{data.get('text')}")
+
+    def expect(self, name: str, timeout: float):
+        """
+        Ждём событие name, пропуская остальные. Возвращает (data, время получения).
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                raise RoundFailed(f"timeout:{name}")
+            try:
+                event, data, ts = self.inbox.get(timeout=left)
+            except queue.Empty:
+                raise RoundFailed(f"timeout:{name}")
+            if event == name:
+                return data, ts
+            if event == "disconnect":
+                raise RoundFailed("disconnect")
+
+    def think(self):
+        time.sleep(random.uniform(self.args.think_min, self.args.think_max))
+
+    def answer(self) -> str:
+        return random.choice(self.args.answers)
+
+    # --- сценарии ---
+    def run_forever(self):
+        try:
+            self.connect(self.login())
+        except RoundFailed as e:
+            self.metrics.error(str(e))
+            return
+        except Exception as e:
+            self.metrics.error(f"connect:{type(e).__name__}")
+            return
+
+        try:
+            scenario = self.duel_round if self.mode == "duel" else self.training_session
+            for i in range(self.args.rounds):
+                if self.run.stopping.is_set():
+                    break
+                if i:
+                    time.sleep(self.args.pause)
+                try:
+                    scenario()
+                except RoundFailed as e:
+                    self.metrics.error(str(e))
+                    if str(e) == "disconnect":
+                        break
+                    # после таймаута в очереди не висим
+                    if self.mode == "duel":
+                        self.sio.emit("queue:leave", {})
+        finally:
+            self.sio.disconnect()
+
+    def duel_round(self):
+        args = self.args
+        self.last_tick = None
+        t0 = time.perf_counter()
+        self.sio.emit("queue:join", {})
+        found, found_ts = self.expect("match:found", args.match_timeout)
+        self.metrics.observe("match_found", found_ts - t0)
+        match_id = found["match_id"]
+
+        self.sio.emit("match:join", {"match_id": match_id})
+        _, started_ts = self.expect("match:started", args.timeout)
+        self.metrics.observe("match_join_to_started", started_ts - found_ts)
+
+        self.think()
+        submit_ts = time.perf_counter()
+        self.run.matches.submitted(match_id, submit_ts)
+        self.sio.emit("match:submit_answer", {"match_id": match_id, "answer": self.answer()})
+
+        ended, ended_ts = self.expect("match:ended", args.timeout + args.match_seconds)
+        last_submit = self.run.matches.ended(match_id)
+        if ended.get("reason") == "both_submitted" and last_submit is not None:
+            self.metrics.observe("submit_to_ended", ended_ts - last_submit)
+        self.metrics.count("match_ended")
+        self.metrics.count(f"match_ended:{ended.get('reason')}")
+
+    def training_session(self):
+        args = self.args
+        self.last_tick = None
+        t0 = time.perf_counter()
+        self.sio.emit("training:join", {})
+        _, task_ts = self.expect("training:task", args.timeout)
+        self.metrics.observe("training_join", task_ts - t0)
+
+        for _ in range(args.training_answers):
+            self.think()
+            submit_ts = time.perf_counter()
+            self.sio.emit("training:submit_answer", {"answer": self.answer()})
+            _, result_ts = self.expect("training:result", args.timeout)
+            self.metrics.observe("training_result", result_ts - submit_ts)
+            self.metrics.count("training_answers")
+            # следующую задачу сервер присылает сам (после паузы в 1 с)
+            _, next_ts = self.expect("training:task", args.timeout + 1)
+            self.metrics.observe("training_next_task", next_ts - result_ts)
+
+        self.sio.emit("training:leave", {})
+
+
+# ----------------------------
+# Run
+# ----------------------------
+class LoadRun:
+    def __init__(self, args):
+        self.args = args
+        self.metrics = Metrics()
+        self.matches = MatchBook()
+        self.stopping = threading.Event()
+
+    def execute(self) -> Dict:
+        args = self.args
+        rnd = random.Random(args.seed)
+        threads = []
+        started = time.perf_counter()
+        deadline = started + args.duration if args.duration else None
+
+        # дуэлянтов держим чётным числом, иначе последний ждёт пару до таймаута
+        n_training = int(round(args.users * args.training))
+        n_duel = args.users - n_training
+        if n_duel % 2:
+            n_duel -= 1
+            n_training += 1
+        modes = ["duel"] * n_duel + ["training"] * n_training
+        rnd.shuffle(modes)
+
+        for i, mode in enumerate(modes):
+            if i and args.rate > 0:
+                time.sleep(rnd.expovariate(args.rate))
+            if deadline and time.perf_counter() >= deadline:
+                break
+            player = Player(self, i, mode)
+            t = threading.Thread(target=player.run_forever, name=f"player-{i}", daemon=True)
+            t.start()
+            threads.append(t)
+            self.metrics.count(f"players:{mode}")
+
+        for t in threads:
+            left = None if not deadline else max(0.0, deadline - time.perf_counter())
+            t.join(left)
+            if deadline and time.perf_counter() >= deadline:
+                break
+        self.stopping.set()
+        elapsed = time.perf_counter() - started
+
+        result = self.metrics.summary()
+        result["elapsed_sec"] = round(elapsed, 2)
+        result["unfinished_players"] = sum(1 for t in threads if t.is_alive())
+        ended = result["counters"].get("match_ended", 0)
+        result["matches_per_sec"] = round(ended / 2 / elapsed, 2) if elapsed else 0.0
+        return result
+
+
+def print_report(result: Dict):
+    print()
+    print(f"{'metric':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in result["latency"].items():
+        print(
+            f"{name:<24}{row['count']:>8}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+            f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}"
+        )
+    print()
+    for name, value in sorted(result["counters"].items()):
+        print(f"{name:<32}{value:>8}")
+    print(f"{'matches/sec':<32}{result['matches_per_sec']:>8}")
+    print(f"{'elapsed sec':<32}{result['elapsed_sec']:>8}")
+    if result["unfinished_players"]:
+        print(f"{'unfinished players':<32}{result['unfinished_players']:>8}")
+    print()
+    if result["errors"]:
+        print("errors:")
+        for kind, n in result["errors"].items():
+            print(f"  {kind:<40}{n:>6}")
+    else:
+        print("errors: 0")
+
+
+# ----------------------------
+# Local server
+# ----------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(args, workdir: str) -> subprocess.Popen:
+    """
+    Сервер из этого же дерева на временной БД. Хэш пароля — дешёвый:
+    регистрация синтетических игроков не то, что мы меряем.
+    """
+    port = free_port()
+    env = dict(os.environ)
+    env.update(
+        {
+            "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "loadtest.db"),
+            "LIVE_STORE_PATH": os.path.join(workdir, "loadtest-live.db"),
+            "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+            "MATCH_SECONDS": str(int(args.match_seconds)),
+            "TICK_RESYNC_SECONDS": str(args.tick_interval),
+        }
+    )
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log = open(os.path.join(workdir, "server.log"), "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-c", f"import app; app.run_server(port={port}, debug=False)"],
+        cwd=ROOT,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    args.url = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"сервер не запустился, лог: {log.name}")
+        try:
+            if requests.get(f"{args.url}/login", timeout=1).status_code == 200:
+                return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    sys.exit(f"сервер не ответил за 30 с, лог: {log.name}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Нагрузочный тест дуэлей и тренировок через Socket.IO.")
+    p.add_argument("--url", default="http://127.0.0.1:5000", help="адрес запущенного сервера")
+    p.add_argument("--spawn", action="store_true", help="поднять свой сервер на временной БД")
+    p.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                   help="переменная окружения для --spawn (например LIVE_STORE=sqlite)")
+    p.add_argument("--users", type=int, default=50, help="сколько синтетических игроков")
+    p.add_argument("--rate", type=float, default=10.0, help="игроков в секунду (пуассоновский поток, 0 — все сразу)")
+    p.add_argument("--training", type=float, default=0.0, help="доля игроков в тренировке, 0..1")
+    p.add_argument("--rounds", type=int, default=3, help="матчей (или тренировок) на игрока")
+    p.add_argument("--training-answers", type=int, default=3, help="ответов за одну тренировку")
+    p.add_argument("--think-min", type=float, default=0.5, help="мин. пауза перед ответом, с")
+    p.add_argument("--think-max", type=float, default=3.0, help="макс. пауза перед ответом, с")
+    p.add_argument("--pause", type=float, default=0.5, help="пауза между раундами, с")
+    p.add_argument("--answers", default="42,0", help="варианты ответов через запятую")
+    p.add_argument("--duration", type=float, default=0.0, help="ограничение прогона, с (0 — до конца)")
+    p.add_argument("--timeout", type=float, default=15.0, help="ожидание ответа сервера, с")
+    p.add_argument("--match-timeout", type=float, default=60.0, help="ожидание соперника в очереди, с")
+    p.add_argument("--match-seconds", type=float, default=600.0, help="длина матча на сервере, с")
+    p.add_argument("--tick-interval", type=float, default=15.0, help="TICK_RESYNC_SECONDS сервера, с")
+    p.add_argument("--transports", default="websocket", help="websocket или polling (через запятую)")
+    p.add_argument("--prefix", default="lt_", help="префикс логинов синтетических игроков")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--json", dest="json_path", help="сохранить результат в файл")
+    args = p.parse_args(argv)
+    args.answers = [a for a in args.answers.split(",") if a] or ["42"]
+    args.transports = [t.strip() for t in args.transports.split(",") if t.strip()]
+    args.url = args.url.rstrip("/")
+    if args.think_max < args.think_min:
+        p.error("--think-max меньше --think-min")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    workdir = None
+    if args.spawn:
+        workdir = tempfile.mkdtemp(prefix="examarena-loadtest-")
+        server = spawn_server(args, workdir)
+        print(f"сервер: {args.url} (временная БД в {workdir})")
+
+    try:
+        result = LoadRun(args).execute()
+    finally:
+        if server:
+            server.terminate()
+            server.wait(10)
+
+    print_report(result)
+    if args.json_path:
+        result["args"] = {k: v for k, v in vars(args).items() if k != "json_path"}
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())